@@ -0,0 +1,173 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" End-to-end benchmark for complete documentation builder runs
+
+The benchmark creates local bare repositories and runs the builder
+against them through ``file://`` URLs in three scenarios:
+
+- ``cold``: empty working directory, everything is cloned and built
+- ``warm``: second run without any upstream changes
+- ``changed``: one document in one package changed upstream
+
+Each scenario runs in a fresh Python process, like a cron job would.
+Usage::
+
+    $ python benchmarks/bench_builder.py --packages 10 --tags 3 \\
+        --json results.json -- --jobs 4
+
+Arguments after ``--`` are handed to the builder unchanged.
+"""
+
+import json
+import optparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fixtures import change_repository
+from fixtures import create_repository
+
+
+OPTIONS = (
+  optparse.make_option('--packages', action='store', dest='packages',
+                       type='int', help='Number of packages', default=5),
+  optparse.make_option('--tags', action='store', dest='tags', type='int',
+                       help='Number of tags per package', default=3),
+  optparse.make_option('--documents', action='store', dest='documents',
+                       type='int', help='Number of documents per package',
+                       default=10),
+  optparse.make_option('--autodoc', action='store', dest='autodoc',
+                       type='int', default=0,
+                       help='Number of autodoc-documented modules per \
+                             package'),
+  optparse.make_option('--rounds', action='store', dest='rounds',
+                       type='int', help='Repetitions of all scenarios',
+                       default=1),
+  optparse.make_option('--json', action='store', dest='json',
+                       help='Write the results to this JSON file'),
+  optparse.make_option('--keep', action='store_true', dest='keep',
+                       help='Keep the temporary folder for inspection',
+                       default=False),
+)
+RUNNER = 'from dataflake.docbuilder import run_builder; run_builder()'
+INDEX_TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src', 'dataflake', 'docbuilder',
+    'index_template')
+
+
+def run_builder(root, urls, builder_args):
+    """ Run the builder in a new process and return timings
+    """
+    workingdir = os.path.join(root, 'work')
+    report_path = os.path.join(root, 'report.json')
+    args = [sys.executable, '-c', RUNNER, '-w', workingdir,
+            '--report', report_path,
+            '--index-template', os.path.join(root, 'index_template')]
+    args.extend(builder_args)
+    for url in urls:
+        args.extend(['-s', url])
+
+    start = time.perf_counter()
+    subprocess.run(args, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    duration = time.perf_counter() - start
+
+    with open(report_path) as fp:
+        report = json.load(fp)
+    phases = {name: value for name, value in
+              report['totals']['phases'].items()
+              if name in ('sync', 'checkout', 'sphinx-read', 'sphinx-write',
+                          'publish', 'index')}
+    return {'duration': duration, 'phases': phases}
+
+
+def run_scenarios(options, builder_args):
+    root = tempfile.mkdtemp(prefix='docbuilder-bench-')
+    try:
+        os.makedirs(os.path.join(root, 'work', 'html'))
+        shutil.copytree(INDEX_TEMPLATE, os.path.join(root, 'index_template'))
+        names = [f'package{x}' for x in range(options.packages)]
+        urls = [create_repository(root, name,
+                                  tags=options.tags,
+                                  documents=options.documents,
+                                  autodoc=options.autodoc)
+                for name in names]
+        results = {'cold': run_builder(root, urls, builder_args),
+                   'warm': run_builder(root, urls, builder_args)}
+        change_repository(root, names[0])
+        results['changed'] = run_builder(root, urls, builder_args)
+    finally:
+        if options.keep:
+            print(f'Benchmark files kept in {root}', file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def summarize(rounds):
+    """ Reduce the results of all rounds to medians per scenario
+    """
+    summary = {}
+    for scenario in rounds[0]:
+        durations = [x[scenario]['duration'] for x in rounds]
+        phases = {}
+        for phase in rounds[0][scenario]['phases']:
+            phases[phase] = statistics.median(
+                x[scenario]['phases'].get(phase, 0.0) for x in rounds)
+        summary[scenario] = {'duration': statistics.median(durations),
+                             'min': min(durations),
+                             'phases': phases}
+    return summary
+
+
+def main():
+    argv = sys.argv[1:]
+    builder_args = []
+    if '--' in argv:
+        builder_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    parser = optparse.OptionParser(option_list=OPTIONS)
+    options, args = parser.parse_args(argv)
+
+    rounds = [run_scenarios(options, builder_args)
+              for x in range(options.rounds)]
+    summary = summarize(rounds)
+
+    phase_names = ('sync', 'checkout', 'sphinx-read', 'sphinx-write',
+                   'publish', 'index')
+    print(f'{"scenario":<10}{"total":>10}' +
+          ''.join(f'{x:>14}' for x in phase_names))
+    for scenario, result in summary.items():
+        print(f'{scenario:<10}{result["duration"]:>9.2f}s' +
+              ''.join(f'{result["phases"].get(x, 0.0):>13.2f}s'
+                      for x in phase_names))
+
+    if options.json:
+        with open(options.json, 'w') as fp:
+            json.dump({'parameters': {'packages': options.packages,
+                                      'tags': options.tags,
+                                      'documents': options.documents,
+                                      'autodoc': options.autodoc,
+                                      'rounds': options.rounds,
+                                      'builder_args': builder_args},
+                       'python': sys.version,
+                       'results': summary,
+                       'rounds': rounds}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Guard the startup time of the package and its scripts
+
+Each scenario runs in a new Python process. The time of a bare Python
+startup is subtracted, and the script fails if a scenario takes longer
+than the budget or loads one of the modules that must only be imported
+once a build starts. Usage::
+
+    $ python benchmarks/bench_import.py --rounds 10 --budget 150
+"""
+
+import json
+import optparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+OPTIONS = (
+  optparse.make_option('--rounds', action='store', dest='rounds',
+                       type='int', help='Repetitions per measurement',
+                       default=5),
+  optparse.make_option('--budget', action='store', dest='budget',
+                       type='float', default=150,
+                       help='Allowed milliseconds per scenario on top of \
+                             the Python startup time'),
+  optparse.make_option('--json', action='store', dest='json',
+                       help='Write the results to this JSON file'),
+)
+
+# Modules that are only needed when a build is actually running
+HEAVY_MODULES = ('sphinx.application', 'pkg_resources', 'dulwich.porcelain',
+                 'importlib.metadata', 'http.server', 'venv')
+
+SCENARIOS = {
+    'python': 'pass',
+    'import': 'import dataflake.docbuilder',
+    'recipe': 'from dataflake.docbuilder import BuildoutScript',
+    'help': ('import sys\n'
+             'sys.argv[1:] = ["--help"]\n'
+             'from dataflake.docbuilder import run_builder\n'
+             'try:\n'
+             '    run_builder()\n'
+             'except SystemExit:\n'
+             '    pass\n'),
+}
+REPORT_MODULES = ('\nimport json, sys\n'
+                  'sys.stderr.write(json.dumps(sorted(sys.modules)))\n')
+
+
+def measure(code):
+    """ Run ``code`` in a new interpreter, return seconds and modules
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code + REPORT_MODULES],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            check=True)
+    duration = time.perf_counter() - start
+    modules = json.loads(result.stderr.decode().splitlines()[-1])
+    return duration, modules
+
+
+def main():
+    parser = optparse.OptionParser(option_list=OPTIONS)
+    options, args = parser.parse_args()
+
+    results = {}
+    for name, code in SCENARIOS.items():
+        durations = []
+        for x in range(options.rounds):
+            duration, modules = measure(code)
+            durations.append(duration)
+        results[name] = {'median': statistics.median(durations),
+                         'min': min(durations),
+                         'heavy modules': [x for x in HEAVY_MODULES
+                                           if x in modules]}
+
+    baseline = results['python']['median']
+    failures = []
+    print(f'{"scenario":<10}{"median":>10}{"overhead":>10}  heavy modules')
+    for name, result in results.items():
+        overhead = (result['median'] - baseline) * 1000
+        result['overhead'] = overhead
+        print(f'{name:<10}{result["median"] * 1000:>8.1f}ms'
+              f'{overhead:>8.1f}ms  {", ".join(result["heavy modules"])}')
+        if name == 'python':
+            continue
+        if overhead > options.budget:
+            failures.append(f'{name} takes {overhead:.1f}ms, budget is '
+                            f'{options.budget:.1f}ms')
+        if result['heavy modules']:
+            failures.append(f'{name} imports ' +
+                            ', '.join(result['heavy modules']))
+
+    if options.json:
+        with open(options.json, 'w') as fp:
+            json.dump({'rounds': options.rounds,
+                       'budget': options.budget,
+                       'python': sys.version,
+                       'results': results}, fp, indent=2)
+
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
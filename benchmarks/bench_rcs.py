@@ -0,0 +1,124 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Compare the RCS client implementations on local repositories
+
+Usage::
+
+    $ python benchmarks/bench_rcs.py --tags 50 --rounds 5
+
+Only ``git`` and the optional ``dulwich`` package are needed, no network
+access is required.
+"""
+
+import json
+import logging
+import optparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from fixtures import create_repository
+
+from dataflake.docbuilder.builder import SUPPORTED_VCS
+
+
+OPTIONS = (
+  optparse.make_option('--tags', action='store', dest='tags', type='int',
+                       help='Number of tags in the test repository',
+                       default=20),
+  optparse.make_option('--files', action='store', dest='files', type='int',
+                       help='Number of files in the test repository',
+                       default=50),
+  optparse.make_option('--rounds', action='store', dest='rounds',
+                       type='int', help='Repetitions per measurement',
+                       default=3),
+  optparse.make_option('--json', action='store', dest='json',
+                       help='Write the results to this JSON file'),
+)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def benchmark_client(client_class, url, root, rounds):
+    """ Time the client operations used during a documentation build
+    """
+    timings = {}
+    logger = logging.getLogger('benchmark')
+    for round_number in range(rounds):
+        client = client_class(logger=logger)
+        checkout = os.path.join(root, f'{client_class.__name__}-checkout')
+        shutil.rmtree(checkout, ignore_errors=True)
+
+        measured = {'clone': timed(client.checkout, url, checkout)}
+        measured['metadata'] = timed(client.get_metadata, url, checkout)
+        tags = client.get_tag_names(url, checkout)
+        main = client.get_main_branch_name(url, checkout)
+
+        client.invalidate_metadata(checkout)
+        measured['update'] = timed(client.update, checkout)
+
+        start = time.perf_counter()
+        for tag in tags:
+            client.checkout_tag(url, tag, checkout)
+        client.checkout_tag(url, main, checkout)
+        measured['checkout all tags'] = time.perf_counter() - start
+
+        for name, value in measured.items():
+            timings.setdefault(name, []).append(value)
+
+    return {name: {'median': statistics.median(values), 'min': min(values)}
+            for name, values in timings.items()}
+
+
+def main():
+    parser = optparse.OptionParser(option_list=OPTIONS)
+    options, args = parser.parse_args()
+    root = tempfile.mkdtemp(prefix='docbuilder-bench-')
+    try:
+        url = create_repository(root, 'package.git', tags=options.tags,
+                                files=options.files)
+        results = {}
+        for name, client_class in sorted(SUPPORTED_VCS.items()):
+            try:
+                results[name] = benchmark_client(client_class, url, root,
+                                                 options.rounds)
+            except Exception as e:
+                print(f'Skipping {name}: {e}', file=sys.stderr)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    operations = sorted({op for result in results.values() for op in result})
+    names = sorted(results)
+    print(f'{"operation":<20}' + ''.join(f'{x:>14}' for x in names))
+    for operation in operations:
+        row = [results[x][operation]['median'] for x in names]
+        print(f'{operation:<20}' + ''.join(f'{x * 1000:>12.1f}ms'
+                                           for x in row))
+
+    if options.json:
+        with open(options.json, 'w') as fp:
+            json.dump({'tags': options.tags,
+                       'files': options.files,
+                       'rounds': options.rounds,
+                       'results': results}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
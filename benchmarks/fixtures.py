@@ -0,0 +1,148 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Synthetic local Git repositories for the benchmarks
+"""
+
+import os
+import subprocess
+
+
+CONF_PY = """\
+project = %(name)r
+extensions = %(extensions)r
+html_theme = 'alabaster'
+"""
+INDEX_RST = """\
+%(name)s
+%(underline)s
+
+.. toctree::
+
+%(toctree)s
+"""
+DOCUMENT_RST = """\
+Document %(number)s
+==================
+
+%(body)s
+"""
+AUTODOC_RST = """\
+API %(number)s
+=======
+
+.. automodule:: %(module)s
+   :members:
+"""
+MODULE_PY = '''\
+""" Generated module %(number)s
+"""
+
+
+'''
+FUNCTION_PY = '''\
+def function_%(number)s(value, other=None):
+    """ Generated function number %(number)s
+
+    :param value: Some value
+    :param other: Another value
+    :returns: Nothing useful
+    """
+    return value
+
+
+'''
+
+
+def git(*args, cwd=None):
+    subprocess.run(('git',) + args, cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def commit_all(source, message):
+    git('add', '-A', cwd=source)
+    git('commit', '-q', '-m', message, cwd=source)
+
+
+def write_file(path, text, mode='w'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode) as fp:
+        fp.write(text)
+
+
+def write_docs(source, name, documents, autodoc, revision):
+    """ Write a Sphinx documentation folder and optional Python modules
+    """
+    docs = os.path.join(source, 'docs')
+    names = [f'document{x}' for x in range(documents)]
+    extensions = []
+    if autodoc:
+        extensions.append('sphinx.ext.autodoc')
+        module_name = name.replace('-', '_')
+        for number in range(autodoc):
+            module = f'{module_name}_api{number}'
+            text = MODULE_PY % {'number': number}
+            for function in range(50):
+                text += FUNCTION_PY % {'number': function}
+            write_file(os.path.join(source, f'{module}.py'), text)
+            write_file(os.path.join(docs, f'api{number}.rst'),
+                       AUTODOC_RST % {'number': number, 'module': module})
+            names.append(f'api{number}')
+
+    write_file(os.path.join(docs, 'conf.py'),
+               CONF_PY % {'name': name, 'extensions': extensions})
+    write_file(os.path.join(docs, 'index.rst'),
+               INDEX_RST % {'name': name,
+                            'underline': '=' * len(name),
+                            'toctree': '\n'.join(f'   {x}' for x in names)})
+    paragraph = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit. '
+                 * 10)
+    for number in range(documents):
+        body = f'Revision {revision}\n\n' + '\n\n'.join([paragraph] * 20)
+        write_file(os.path.join(docs, f'document{number}.rst'),
+                   DOCUMENT_RST % {'number': number, 'body': body})
+
+
+def create_repository(root, name, tags=0, documents=1, autodoc=0, files=0):
+    """ Create a bare repository at ``<root>/<name>`` and return its URL
+
+    The main branch is called ``main``. Each of the ``tags`` releases is a
+    separate commit with a tag named ``1.<number>``. ``files`` adds plain
+    files that change with every commit.
+    """
+    source = os.path.join(root, 'sources', name)
+    os.makedirs(source)
+    git('init', '-q', '-b', 'main', cwd=source)
+    git('config', 'user.name', 'Benchmark', cwd=source)
+    git('config', 'user.email', 'benchmark@example.com', cwd=source)
+    for revision in range(tags + 1):
+        write_docs(source, name, documents, autodoc, revision)
+        for number in range(files):
+            write_file(os.path.join(source, 'data', f'file{number}.txt'),
+                       f'Line for revision {revision}\n', mode='a')
+        commit_all(source, f'Revision {revision}')
+        if revision < tags:
+            git('tag', f'1.{revision}', cwd=source)
+
+    bare = os.path.join(root, name)
+    git('clone', '-q', '--bare', source, bare)
+    return f'file://{bare}'
+
+
+def change_repository(root, name, document=0):
+    """ Push a single commit that changes one document in ``name``
+    """
+    source = os.path.join(root, 'sources', name)
+    write_file(os.path.join(source, 'docs', f'document{document}.rst'),
+               '\nChanged paragraph.\n', mode='a')
+    commit_all(source, 'Change one document')
+    git('push', '-q', os.path.join(root, name), 'main', cwd=source)
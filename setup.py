@@ -57,8 +57,11 @@ setup(name='dataflake.docbuilder',
       include_package_data=True,
       python_requires='>=3.7',
       install_requires=[
+        'importlib_metadata; python_version < "3.8"',
+        'packaging',
         'setuptools',
         'sphinx',
+        'tomli; python_version < "3.11"',
         'zc.buildout',
         'zc.recipe.egg',
         ],
@@ -66,10 +69,16 @@ setup(name='dataflake.docbuilder',
         'docs': ['pkginfo',
                  'sphinx_rtd_theme',
                  ],
+        'brotli': ['brotli'],
+        'dulwich': ['dulwich >= 0.23'],
+        'test': ['zope.testrunner'],
         },
       zip_safe=False,
       entry_points={
-        'console_scripts': ['docbuilder = dataflake.docbuilder:run_builder'],
+        'console_scripts': [
+            'docbuilder = dataflake.docbuilder:run_builder',
+            'docbuilder-daemon = dataflake.docbuilder:run_daemon',
+            ],
         'zc.buildout': ['default=dataflake.docbuilder:BuildoutScript']
         },
       )
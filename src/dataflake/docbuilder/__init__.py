@@ -16,7 +16,6 @@
 import os
 
 import dataflake.docbuilder
-from dataflake.docbuilder.builder import DocsBuilder
 
 
 INITIALIZATION = """\
@@ -26,10 +25,21 @@ sys.argv.extend(%(script_arguments)s)
 
 
 def run_builder():
+    from dataflake.docbuilder.builder import DocsBuilder
+
     builder = DocsBuilder()
     builder.run()
 
 
+def run_daemon():
+    from dataflake.docbuilder.builder import DocsBuilder
+    from dataflake.docbuilder.daemon import DAEMON_OPTIONS
+    from dataflake.docbuilder.daemon import DocsDaemon
+
+    builder = DocsBuilder(extra_options=DAEMON_OPTIONS)
+    DocsDaemon(builder).run()
+
+
 class BuildoutScript:
 
     def __init__(self, buildout, name, options):
@@ -98,9 +108,83 @@ class BuildoutScript:
         if self.options.get('max-tags'):
             script_args.extend(['-m', self.options['max-tags']])
 
+        if self.options.get('include-tags'):
+            script_args.extend(['--include-tags',
+                                self.options['include-tags'].strip()])
+
+        if self.options.get('exclude-tags'):
+            script_args.extend(['--exclude-tags',
+                                self.options['exclude-tags'].strip()])
+
+        if self.options.get('prereleases'):
+            script_args.append('--prereleases')
+
+        if self.options.get('latest-patch'):
+            script_args.append('--latest-patch')
+
+        if self.options.get('force'):
+            script_args.append('-f')
+
+        if self.options.get('retry-failed'):
+            script_args.append('--retry-failed')
+
         if self.options.get('verbose'):
             script_args.extend(['-v', self.options['verbose']])
 
+        if self.options.get('jobs'):
+            script_args.extend(['-j', self.options['jobs']])
+
+        if self.options.get('build-jobs'):
+            script_args.extend(['--build-jobs', self.options['build-jobs']])
+
+        if self.options.get('clone-strategy'):
+            script_args.extend(['--clone-strategy',
+                                self.options['clone-strategy'].strip()])
+
+        if self.options.get('mirror-cache'):
+            script_args.extend(['--mirror-cache',
+                                self.options['mirror-cache'].strip()])
+
+        if self.options.get('vcs-timeout'):
+            script_args.extend(['--vcs-timeout',
+                                self.options['vcs-timeout'].strip()])
+
+        if self.options.get('worker-memory'):
+            script_args.extend(['--worker-memory',
+                                self.options['worker-memory'].strip()])
+
+        if self.options.get('worker-builds'):
+            script_args.extend(['--worker-builds',
+                                self.options['worker-builds'].strip()])
+
+        if self.options.get('build-envs'):
+            script_args.append('--build-envs')
+
+        if self.options.get('env-budget'):
+            script_args.extend(['--env-budget',
+                                self.options['env-budget'].strip()])
+
+        if self.options.get('precompress'):
+            script_args.append('--precompress')
+
+        if self.options.get('brotli'):
+            script_args.append('--brotli')
+
+        if self.options.get('dedup'):
+            script_args.append('--dedup')
+
+        if self.options.get('package-weights'):
+            weight_specs = self.options['package-weights'].split('\n')
+            for weight_spec in [x.strip() for x in weight_specs if x]:
+                script_args.extend(['--package-weight', weight_spec])
+
+        if self.options.get('time-budget'):
+            script_args.extend(['--time-budget',
+                                self.options['time-budget'].strip()])
+
+        if self.options.get('report'):
+            script_args.extend(['--report', self.options['report'].strip()])
+
         if self.options.get('index-template'):
             index_template = self.options['index-template']
         else:
@@ -13,24 +13,58 @@
 """ The documentation builder class
 """
 
+import errno
+import hashlib
+import json
 import logging
 import optparse
 import os
 import re
 import shutil
 import sys
+import tempfile
+import time
 import warnings
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
-import pkg_resources
-from sphinx.application import Sphinx
+import sphinx
 
+from .compress import Precompressor
+from .compress import import_brotli
+from .dedup import Deduplicator
+from .envs import EnvironmentCache
+from .envs import build_in_environment
+from .envs import read_requirements
+from .rcs import DulwichClient
 from .rcs import GitClient
+from .rcs import RCSError
+from .report import BuildReport
+from .schedule import BuildSchedule
+from .state import FAILED
+from .state import NO_DOCS
+from .state import SUCCESS
+from .state import BuildState
+from .tags import TagSelector
+from .utils import command_listeners
+from .utils import write_if_changed
+from .workers import WorkerPool
+from .workers import peak_memory_usage
+from .workers import reset_peak_memory
 
 
 LOG = logging.getLogger()
 LOG.addHandler(logging.StreamHandler(sys.stdout))
-SUPPORTED_VCS = {'git': GitClient}
+SUPPORTED_VCS = {'git': GitClient, 'dulwich': DulwichClient}
 VCS_SPEC_MATCH = re.compile(r'^\[(.*)\](.*)$')
+STATE_DB = '.docbuilder-state.sqlite'
+REPORT_FILE = 'build-report.json'
+CLONE_STRATEGIES = ('full', 'blobless', 'shallow')
+DOCTREE_CACHE = '.doctrees'
+GENERATIONS = '.generations'
+DEDUP_STORE = '.objects'
+ENV_CACHE = '.envs'
 
 OPTIONS = (
   optparse.make_option('-s', '--source',
@@ -56,6 +90,24 @@ OPTIONS = (
                              If the value is "0" or "1", only the trunk is \
                              built. Default: 5',
                        default=5),
+  optparse.make_option('--include-tags',
+                       action='store', dest='include_tags',
+                       help='Regular expression that tags must match to be \
+                             built'),
+  optparse.make_option('--exclude-tags',
+                       action='store', dest='exclude_tags',
+                       help='Regular expression for tags that are not \
+                             built'),
+  optparse.make_option('--prereleases',
+                       action='store_true', dest='prereleases',
+                       help='Also build pre-release and development release \
+                             tags',
+                       default=False),
+  optparse.make_option('--latest-patch',
+                       action='store_true', dest='latest_patch',
+                       help='Only build the newest tag of each MAJOR.MINOR \
+                             release series',
+                       default=False),
   optparse.make_option('-v', '--verbose',
                        action='count', dest='verbose',
                        help='Log verbosity'),
@@ -73,17 +125,114 @@ OPTIONS = (
                        help='Sphinx documentation folder name (can be used \
                              multiple times, default: "doc" and "docs")',
                        default=['doc', 'docs']),
+  optparse.make_option('-j', '--jobs',
+                       action='store', dest='jobs',
+                       help='Number of repositories to clone or update \
+                             concurrently. Default: 1',
+                       default=1),
+  optparse.make_option('--build-jobs',
+                       action='store', dest='build_jobs',
+                       help='Number of Sphinx builds to run in parallel. \
+                             Values above 1 build each tag in its own \
+                             isolated checkout. Default: 1',
+                       default=1),
+  optparse.make_option('-f', '--force',
+                       action='store_true', dest='force',
+                       help='Update all repositories and rebuild the main \
+                             branch, all tags and the index pages even if \
+                             nothing has changed (default: False)',
+                       default=False),
+  optparse.make_option('--clone-strategy',
+                       action='store', dest='clone_strategy',
+                       type='choice', choices=CLONE_STRATEGIES,
+                       help='How much of each repository to clone: "full", \
+                             "blobless" (file contents are downloaded on \
+                             demand) or "shallow" (only the newest commit, \
+                             tags are fetched when needed). Default: full',
+                       default='full'),
+  optparse.make_option('--mirror-cache',
+                       action='store', dest='mirror_cache',
+                       help='Folder for shared bare mirrors of all \
+                             repositories. Checkouts borrow their objects \
+                             from the mirrors. Default: no mirrors'),
+  optparse.make_option('--vcs-timeout',
+                       action='store', dest='vcs_timeout', type='float',
+                       help='Abort any single version control command after \
+                             this many seconds. Default: no timeout',
+                       default=None),
+  optparse.make_option('--retry-failed',
+                       action='store_true', dest='retry_failed',
+                       help='Retry builds that failed before even if their \
+                             sources have not changed',
+                       default=False),
+  optparse.make_option('--worker-memory',
+                       action='store', dest='worker_memory', type='int',
+                       help='Replace a build worker process when it uses \
+                             more than this many MB. Default: 1024',
+                       default=1024),
+  optparse.make_option('--worker-builds',
+                       action='store', dest='worker_builds', type='int',
+                       help='Replace a build worker process after this many \
+                             builds, 0 means no limit. Default: 1',
+                       default=1),
+  optparse.make_option('--build-envs',
+                       action='store_true', dest='build_envs',
+                       help='Build each tag in a cached virtual environment \
+                             with the requirements the tag declares',
+                       default=False),
+  optparse.make_option('--env-budget',
+                       action='store', dest='env_budget', type='int',
+                       help='Disk space in MB for cached build environments. \
+                             Default: 2048',
+                       default=2048),
+  optparse.make_option('--precompress',
+                       action='store_true', dest='precompress',
+                       help='Write gzip-compressed copies of new or changed \
+                             HTML, CSS, JavaScript, JSON and SVG files for \
+                             static web servers',
+                       default=False),
+  optparse.make_option('--brotli',
+                       action='store_true', dest='brotli',
+                       help='Also write brotli-compressed copies, implies \
+                             --precompress. Requires the brotli package',
+                       default=False),
+  optparse.make_option('--dedup',
+                       action='store_true', dest='dedup',
+                       help='Replace identical files in the published HTML \
+                             output of all packages and tags by hard links',
+                       default=False),
+  optparse.make_option('--package-weight',
+                       action='append', dest='package_weights',
+                       help='Package name and weight, colon-separated. The \
+                             tags of packages with a higher weight are \
+                             built earlier. Default weight: 1'),
+  optparse.make_option('--time-budget',
+                       action='store', dest='time_budget', type='float',
+                       help='Seconds after which no new updates or builds \
+                             are started, the rest is left for the next \
+                             run. Default: no limit',
+                       default=None),
+  optparse.make_option('--report',
+                       action='store', dest='report',
+                       help='Path for the JSON timing report written at the \
+                             end of the run. Default: \
+                             $working-directory/build-report.json'),
 )
 
 
 class DocsBuilder:
 
-    def __init__(self):
-        parser = optparse.OptionParser(option_list=OPTIONS)
+    def __init__(self, extra_options=()):
+        parser = optparse.OptionParser(option_list=OPTIONS +
+                                       tuple(extra_options))
         self.options, self.args = parser.parse_args()
         self.packages = {}
         self.group_map = {}
-        self.rcs = None
+        self.clients = {}
+        self._build_pool = None
+        self.state = None
+        self.environments = None
+        self.report = BuildReport()
 
         if self.options.verbose:
             LOG.setLevel(logging.DEBUG)
@@ -114,49 +263,397 @@ class DocsBuilder:
         except ValueError:
             LOG.error('Please specify a numeric value for --max-tags.')
 
+        try:
+            self.options.jobs = max(int(self.options.jobs), 1)
+        except ValueError:
+            parser.error('Please specify a numeric value for --jobs.')
+
+        try:
+            self.options.build_jobs = max(int(self.options.build_jobs), 1)
+        except ValueError:
+            parser.error('Please specify a numeric value for --build-jobs.')
+
+        self.package_weights = {}
+        for weight_spec in self.options.package_weights or []:
+            package_name, _, weight = weight_spec.rpartition(':')
+            try:
+                weight = float(weight)
+            except ValueError:
+                weight = 0
+            if weight <= 0:
+                parser.error('Please specify --package-weight as '
+                             'NAME:WEIGHT with a positive number.')
+            self.package_weights[package_name.strip()] = weight
+
         for group_spec in self.options.groupings or []:
             package_name, group_name = (x.strip() for x in
                                         group_spec.split(':'))
             group_values = self.group_map.setdefault(group_name, [])
             group_values.append(package_name)
 
-    def run(self):
-        grouped = []
-        [grouped.extend(x) for x in self.group_map.values()]
+        try:
+            self.tag_selector = TagSelector(
+                                    include=self.options.include_tags,
+                                    exclude=self.options.exclude_tags,
+                                    prereleases=self.options.prereleases,
+                                    latest_patch=self.options.latest_patch)
+        except re.error as e:
+            parser.error(f'Invalid tag pattern: {e}')
+
+        if self.options.mirror_cache:
+            self.options.mirror_cache = os.path.abspath(
+                                            self.options.mirror_cache)
+
+        if self.options.brotli:
+            if import_brotli() is None:
+                parser.error('Please install the brotli package to use '
+                             '--brotli.')
+            self.options.precompress = True
+
+        if self.options.build_envs:
+            self.environments = EnvironmentCache(
+                                os.path.join(self.options.workingdir,
+                                             ENV_CACHE),
+                                budget=self.options.env_budget * 1024 * 1024,
+                                timeout=self.options.vcs_timeout)
+
+    def run(self, package_names=None):
+        """ Update and build all packages, or only ``package_names``
+
+        The index pages are built at the end and always list all packages
+        known so far.
+        """
+        self.report = BuildReport()
+        command_listeners.append(self._record_command)
+        os.makedirs(self.options.workingdir, exist_ok=True)
+        self.state = BuildState(os.path.join(self.options.workingdir,
+                                             STATE_DB))
+
+        try:
+            try:
+                self.build_packages(package_names)
+            finally:
+                if self._build_pool is not None:
+                    self._build_pool.shutdown()
+                    self.report.count('workers recycled',
+                                      self._build_pool.recycled)
+                    self._build_pool = None
+
+            if self.options.index_template:
+                with self.report.span('index'):
+                    self.create_index_html()
+
+            if self.options.precompress:
+                with self.report.span('precompress'):
+                    self.precompress()
+
+            if self.options.dedup:
+                with self.report.span('dedup'):
+                    self.deduplicate()
+        finally:
+            command_listeners.remove(self._record_command)
+            self.state.close()
+            self.write_report()
+
+    def build_packages(self, package_names=None):
+        """ Update and build all packages, or only ``package_names``
+
+        Repositories are updated and packages are built at the same time,
+        each package is built as soon as its repository is up to date.
+        ``--jobs`` limits the number of repositories updated at once and
+        ``--build-jobs`` the number of builds. Waiting builds are started
+        in the order of a ``BuildSchedule``. Once ``--time-budget`` is used
+        up, no new work is started and the rest is left for the next run.
+        Afterwards ``self.packages`` has the same order as after updating
+        one repository after the other.
+        """
+        deadline = None
+        if self.options.time_budget:
+            deadline = time.monotonic() + self.options.time_budget
+        schedule = BuildSchedule(self.package_weights)
+        summary = {'unchanged': [], 'failed': [], 'deferred': []}
+        deferred = []
+        pending = []
+        known = list(self.packages)
+
+        with ThreadPoolExecutor(max_workers=self.options.jobs,
+                                thread_name_prefix='docbuilder-sync') as pool:
+            futures = self.start_sync(pool, package_names)
+            syncing = list(futures)
+            while True:
+                if deadline and time.monotonic() > deadline:
+                    for future in syncing:
+                        future.cancel()
+
+                for future in [x for x in syncing if x.done()]:
+                    syncing.remove(future)
+                    package_name = self.finish_sync(future, futures[future],
+                                                    summary)
+                    if package_name is None:
+                        continue
+                    for rank, tag in self.plan_html_builds(package_name):
+                        schedule.add(package_name, tag, rank)
+
+                done = [x for x in pending if x[-1].done()]
+                pending = [x for x in pending if x not in done]
+                self.finish_html_builds(done)
+
+                if schedule and len(pending) < self.options.build_jobs:
+                    package_name, tag = schedule.pop()
+                    if self._fits_time_budget(package_name, tag, deadline):
+                        build = self.start_html_build(package_name, tag)
+                        if build is not None:
+                            pending.append(build)
+                    else:
+                        deferred.append(f'{package_name} {tag}')
+                    continue
+
+                if not syncing and not pending:
+                    break
+                # Wake up at the deadline to cancel the waiting work.
+                # Once it has passed, only running work is left.
+                timeout = None
+                if deadline and time.monotonic() < deadline:
+                    timeout = max(0, deadline - time.monotonic())
+                wait(syncing + [x[-1] for x in pending], timeout=timeout,
+                     return_when=FIRST_COMPLETED)
+
+        # Updates finish in any order, new packages are added in the order
+        # of the ``--source`` arguments like a serial update would do.
+        names = [self.get_client(vcs).name_from_url(url)
+                 for vcs, url in futures.values()]
+        self.packages = {x: self.packages[x] for x in known + names
+                         if x in self.packages}
+
+        self._log_sync_summary(summary, len(futures))
+        if deferred:
+            LOG.warning('Time budget used up, left for the next run: %s' %
+                        ', '.join(deferred))
+            self.report.count('builds deferred', len(deferred))
+
+    def write_report(self):
+        """ Write the timing report for this run as JSON file
+        """
+        self.report.finish()
+        report_path = self.options.report or \
+            os.path.join(self.options.workingdir, REPORT_FILE)
+        try:
+            self.report.write(report_path)
+        except OSError as e:
+            LOG.error(f'Cannot write report {report_path}: {e}')
+        else:
+            LOG.info(f'Wrote build report to {report_path}')
+
+    def _record_command(self, result):
+        """ Add a command run through ``utils.run_cmd`` to the report
+        """
+        if result.args[1:2] == ['clone']:
+            path = result.args[-1]
+        else:
+            path = result.cwd
+        package = None
+        if path:
+            workingdir = os.path.abspath(self.options.workingdir)
+            relative = os.path.relpath(os.path.abspath(path), workingdir)
+            if not relative.startswith(os.pardir):
+                package = relative.split(os.sep)[0]
+        self.report.add_span(_command_phase(result.args), result.duration,
+                             package, detail=True)
+        self.report.count('command output bytes', result.output_bytes,
+                          package)
 
+    def get_sources(self):
+        """ Get ``(vcs, url)`` tuples for all supported ``--source`` URLs
+        """
+        sources = []
         for url in self.options.urls or []:
             re_match = VCS_SPEC_MATCH.search(url)
             if re_match is not None:
-                rcs_class = SUPPORTED_VCS.get(re_match.groups()[0].lower())
+                vcs = re_match.groups()[0].lower()
                 package_url = re_match.groups()[1].strip()
             else:
-                rcs_class = SUPPORTED_VCS.get('git')
+                vcs = 'git'
                 package_url = url
 
-            if rcs_class is None:
+            if self.get_client(vcs) is None:
                 LOG.warning(f'Unsupported VCS URL, ignoring: {url}')
                 continue
 
-            self.rcs = rcs_class(logger=LOG)
-            package_name = self.rcs.name_from_url(package_url)
-            info = self.rcs.checkout_or_update(
-                package_url,
-                self.options.workingdir,
-                trunk_only=self.options.trunk_only)
-            self.packages[package_name] = info
+            sources.append((vcs, package_url))
+
+        return sources
+
+    def start_sync(self, pool, package_names=None):
+        """ Hand the repository updates to the thread pool ``pool``
+
+        Returns a mapping of futures to sources in the order of the
+        sources, pass each future and its source to ``finish_sync`` when
+        it is done.
+        """
+        for rcs in self.clients.values():
+            if rcs is not None:
+                rcs.reset_mirrors()
+        sources = self.get_sources()
+        if package_names is not None:
+            sources = [x for x in sources if
+                       self.get_client(x[0]).name_from_url(x[1]) in
+                       package_names]
+        return {pool.submit(self._sync_package, x): x for x in sources}
+
+    def finish_sync(self, future, source, summary):
+        """ Take over the result of a repository update
+
+        ``summary`` collects the unchanged, failed and cancelled updates.
+        Returns the package name if the package can be built. Packages
+        whose update was cancelled are not built, but if they were checked
+        out before they are still listed in the index.
+        """
+        if future.cancelled():
+            summary['deferred'].append(source[1])
+            package_name, info = self._get_local_package(source)
+            if info is not None:
+                self._add_package(package_name, info)
+            return None
+        package_url, package_name, info = future.result()
+        if info is None:
+            summary['failed'].append(package_url)
+            return None
+        if info['unchanged']:
+            summary['unchanged'].append(package_name)
+        self._add_package(package_name, info)
+        return package_name
+
+    def _add_package(self, package_name, info):
+        """ Remember a package for the builds and the index pages
+
+        Packages that are not in any ``--group`` are listed ungrouped.
+        """
+        self.packages[package_name] = info
+        if not any(package_name in x for x in self.group_map.values()):
+            self.group_map.setdefault('', []).append(package_name)
+
+    def _get_local_package(self, source):
+        """ Describe the existing checkout of a source without updating it
+
+        Returns the package name and its package information, which is
+        None if there is no usable checkout.
+        """
+        vcs, package_url = source
+        rcs = self.get_client(vcs)
+        package_name = rcs.name_from_url(package_url)
+        package_path = os.path.join(self.options.workingdir, package_name)
+        if not os.path.isdir(package_path):
+            return package_name, None
+        try:
+            info = rcs.get_package_info(package_url,
+                                        self.options.workingdir,
+                                        trunk_only=self.options.trunk_only)
+        except Exception as e:
+            LOG.error(f'Reading the checkout of {package_name} failed: {e}')
+            return package_name, None
+        info['vcs'] = vcs
+        info['tags'] = self.tag_selector.select(info['tags'])
+        info['unchanged'] = True
+        return package_name, info
+
+    def _log_sync_summary(self, summary, total):
+        unchanged = summary['unchanged']
+        if unchanged:
+            LOG.info(f'{len(unchanged)} of {total} repositories '
+                     'unchanged upstream, not updated: %s' %
+                     ', '.join(sorted(unchanged)))
+            self.report.count('repositories unchanged', len(unchanged))
+        if summary['deferred']:
+            LOG.warning(f'Time budget used up, {len(summary["deferred"])} '
+                        'repositories were not updated.')
+            self.report.count('updates deferred', len(summary['deferred']))
+        if summary['failed']:
+            LOG.error('Could not clone or update: %s' %
+                      ', '.join(summary['failed']))
+
+    def _sync_package(self, source):
+        """ Clone or update a single package repository
+
+        Errors are logged and reported back instead of being raised so
+        one broken repository cannot abort the others.
+        """
+        vcs, package_url = source
+        rcs = self.get_client(vcs)
+        package_name = rcs.name_from_url(package_url)
+        try:
+            with self.report.span('sync', package_name):
+                if self._is_unchanged(rcs, package_url, package_name):
+                    info = rcs.get_package_info(
+                                    package_url,
+                                    self.options.workingdir,
+                                    trunk_only=self.options.trunk_only)
+                    info['unchanged'] = True
+                else:
+                    info = rcs.checkout_or_update(
+                                    package_url,
+                                    self.options.workingdir,
+                                    trunk_only=self.options.trunk_only)
+                    info['unchanged'] = False
+                    self.state.set_refs(package_url, rcs.get_local_refs(
+                                    package_url, info['path']))
+        except Exception as e:
+            LOG.error(f'Updating {package_name} from {package_url} '
+                      f'failed: {e}')
+            info = None
+        else:
+            info['vcs'] = vcs
+            info['tags'] = self.tag_selector.select(info['tags'])
 
-        for package_name in self.packages.keys():
-            if package_name not in grouped:
-                group_values = self.group_map.setdefault('', [])
-                group_values.append(package_name)
+        return package_url, package_name, info
 
-            self.build_html(package_name)
+    def _is_unchanged(self, rcs, package_url, package_name):
+        """ Find out if a remote repository changed since the last update
 
-        if self.options.index_template:
-            self.create_index_html()
+        The main branch and tag refs of the remote are compared with the
+        refs that were recorded after the last update. This needs no fetch
+        and is disabled by ``--force``.
+        """
+        package_path = os.path.join(self.options.workingdir, package_name)
+        known_refs = self.state.get_refs(package_url)
+        if self.options.force or not known_refs or \
+           not os.path.isdir(package_path):
+            return False
+
+        main_branch = rcs.get_main_branch_name(package_url, package_path)
+        with self.report.span('preflight', package_name):
+            remote_refs = rcs.get_remote_refs(package_url, main_branch)
+        return remote_refs == known_refs
+
+    def get_client(self, vcs):
+        """ Get the shared RCS client for a VCS name like ``git``
+
+        Clients are created once and reused for all repositories. Returns
+        None for unsupported VCS names.
+        """
+        if vcs not in self.clients:
+            rcs_class = SUPPORTED_VCS.get(vcs)
+            if rcs_class is None:
+                return None
+            try:
+                self.clients[vcs] = rcs_class(
+                                  logger=LOG,
+                                  clone_strategy=self.options.clone_strategy,
+                                  timeout=self.options.vcs_timeout,
+                                  mirror_cache=self.options.mirror_cache)
+            except RCSError as e:
+                LOG.error(f'Cannot use {vcs}: {e}')
+                self.clients[vcs] = None
+        return self.clients[vcs]
 
     def create_index_html(self):
-        index_text = ''
+        """ Generate the index pages and build them with Sphinx
+
+        Packages whose repository could not be updated are left out.
+        Source files are only written if their content changed and the
+        Sphinx build is skipped if the HTML output is newer than all
+        files in the index template folder.
+        """
+        index_parts = []
         group_names = sorted(self.group_map.keys(), key=str.lower)
         output = {'package': PACKAGE_RST,
                   'link': LINK_RST,
@@ -171,9 +668,14 @@ class DocsBuilder:
                 group_name = group_name or 'Ungrouped'
                 group_data = {'group_name': group_name,
                               'group_underline': '=' * len(group_name)}
-                index_text += output['groupheader'] % group_data
+                index_parts.append(output['groupheader'] % group_data)
 
             for package_name in package_names:
+                if package_name not in self.packages:
+                    LOG.warning(f'No repository information for '
+                                f'{package_name}, not adding it to the '
+                                'index.')
+                    continue
                 tags_list = []
                 package_info = self.packages[package_name]
                 main_branch = package_info['main_branch']
@@ -183,10 +685,11 @@ class DocsBuilder:
                 tag_names.insert(0, main_branch)
 
                 for tag_name in tag_names:
-                    html_output_folder = package_info['tag_html'].get(tag_name)
+                    target_name = self._target_name(package_name, tag_name)
+                    record = self.state.get(target_name)
                     tag_folder = ''
-                    if html_output_folder:
-                        tag_folder = os.path.basename(html_output_folder)
+                    if record is not None and record['status'] == SUCCESS:
+                        tag_folder = os.path.basename(record['output'])
 
                     tag_data = {'package_name': package_name,
                                 'package_tag': tag_name,
@@ -200,7 +703,7 @@ class DocsBuilder:
                     tags_list.append(tag_txt)
 
                 if self.options.trunk_only:
-                    index_text += '%s\n' % tags_list[0]
+                    index_parts.append('%s\n' % tags_list[0])
                 else:
                     underline = '_' * len(package_name)
                     if len(tags_list) > self.options.max_tags:
@@ -212,52 +715,66 @@ class DocsBuilder:
                     p_data = {'package_name': package_name,
                               'package_output': '\n'.join(index_tags),
                               'package_name_underline': underline}
-                    index_text += output['package'] % p_data
-                    index_text += more_link
+                    index_parts.append(output['package'] % p_data)
+                    index_parts.append(more_link)
 
                     # Create separate per-package page
                     pkg_file_path = os.path.join(self.options.index_template,
                                                  '%s.rst' % package_name)
-                    package_file = open(pkg_file_path, 'w')
                     pkg_data = {'package_name': package_name,
                                 'package_output': '\n'.join(tags_list),
                                 'package_name_underline': underline}
-                    package_file.write(':orphan:\n\n')
-                    package_file.write(output['package'] % pkg_data)
-                    package_file.close()
+                    write_if_changed(pkg_file_path, ':orphan:\n\n%s' %
+                                     (output['package'] % pkg_data))
 
         index_path = os.path.join(self.options.index_template,
                                   '%s.rst' % self.options.index_name)
         template_path = os.path.join(self.options.index_template,
                                      '%s.rst.in' % self.options.index_name)
         if os.path.isfile(template_path):
-            template_file = open(template_path)
-            template_text = template_file.read()
-            template_file.close()
+            with open(template_path) as template_file:
+                template_text = template_file.read()
         else:
             template_text = ''
 
-        index_file = open(index_path, 'w')
-        index_file.write(template_text)
-        index_file.write('\n\n')
-        index_file.write(index_text)
-        index_file.close()
+        index_text = ''.join(index_parts)
+        write_if_changed(index_path, f'{template_text}\n\n{index_text}')
 
         required_index = os.path.join(self.options.index_template, 'index.rst')
         if index_path != required_index and not os.path.isfile(required_index):
             # Need to create a index.rst, otherwise Sphinx barfs
             required_index_contents = ''
             if os.path.isfile('%s.in' % required_index):
-                tmpl = open('%s.in' % required_index)
-                required_index_contents = tmpl.read()
-                tmpl.close()
-            tmp_index = open(required_index, 'w')
-            tmp_index.write(required_index_contents)
-            tmp_index.close()
+                with open('%s.in' % required_index) as tmpl:
+                    required_index_contents = tmpl.read()
+            write_if_changed(required_index, required_index_contents)
+
+        if self._index_is_current():
+            LOG.info('Index pages unchanged, skipping.')
+            return
 
         self._build_sphinx()
 
+    def _index_is_current(self):
+        """ Check if the index HTML is newer than all index template files
+        """
+        index_html = os.path.join(self.options.htmldir,
+                                  '%s.html' % self.options.index_name)
+        if self.options.force or not os.path.isfile(index_html):
+            return False
+
+        built = os.path.getmtime(index_html)
+        template = self.options.index_template
+        for dirpath, dirnames, filenames in os.walk(template):
+            dirnames[:] = [x for x in dirnames if x != '_build']
+            for filename in filenames:
+                if os.path.getmtime(os.path.join(dirpath, filename)) > built:
+                    return False
+        return True
+
     def _build_sphinx(self):
+        from sphinx.application import Sphinx
+
         dt = os.path.join(self.options.index_template, '_build', 'doctrees')
         if self.options.verbose and self.options.verbose > 1:
             output_pipeline = sys.stderr
@@ -275,105 +792,550 @@ class DocsBuilder:
                          freshenv=False,
                          warningiserror=False,
                          tags=None)
-        builder.build(True, None)
+        builder.build(False, None)
 
     def build_html(self, package_name):
+        self.finish_html_builds(self.start_html_builds(package_name))
+
+    def start_html_builds(self, package_name):
+        """ Start building the main branch and tags of a package
+
+        Sphinx builds run in worker processes, which are replaced when
+        they grow too large. With ``--build-jobs`` at 1 the builds happen
+        one after the other in the shared package checkout. Otherwise every
+        tag is exported into its own isolated tree and several builds run
+        at the same time. The list of builds that are still running is
+        returned, pass it to ``finish_html_builds``.
+        """
+        pending = []
+        for rank, tag in self.plan_html_builds(package_name):
+            build = self.start_html_build(package_name, tag)
+            if build is None:
+                continue
+            if self.options.build_jobs > 1:
+                pending.append(build)
+            else:
+                # The next tag is checked out in the same place
+                self.finish_html_builds([build])
+        return pending
+
+    def plan_html_builds(self, package_name):
+        """ Get the main branch and tags of a package that need a build
+
+        Returns ``(rank, tag)`` tuples. The main branch has rank 0 and
+        comes first, followed by the tags within the ``--max-tags`` limit,
+        newest first.
+        """
         package_info = self.packages[package_name]
-        package_info['tag_html'] = {}
-        package_path = package_info['path']
         main_branch = package_info['main_branch']
         package_tags = list(reversed(package_info['tags']))
         if self.options.max_tags and \
            len(package_tags) > self.options.max_tags:
             package_tags = package_tags[:self.options.max_tags]
-        tags = [main_branch] + package_tags
+        planned = []
 
-        for tag in tags:
-            if tag == main_branch:
-                target_name = package_name
-            else:
-                target_name = f'{package_name}-{tag}'
+        for rank, tag in enumerate([main_branch] + package_tags):
+            target_name = self._target_name(package_name, tag)
             html_path = os.path.join(self.options.htmldir, target_name)
+            commit_id = package_info['commits'].get(tag)
+            inputs = self._get_build_inputs(commit_id)
 
-            if os.path.isfile(os.path.join(html_path, 'index.html')) and \
-               tag != main_branch:
-                # Documentation has been built already, don't do any more work
-                LOG.info(f'{package_name} tag {tag} done already, skipping.')
-                package_info['tag_html'][tag] = html_path
-                continue
+            if self.options.force or not self._is_built(
+                    package_name, tag, html_path, commit_id, inputs):
+                planned.append((rank, tag))
 
-            self.rcs.checkout_tag(package_info['url'], tag, package_path)
+        return planned
 
-            doc_folder = None
-            for folder_name in self.options.docs_folders:
-                doc_candidate = os.path.join(package_path, folder_name)
-                if os.path.isdir(doc_candidate) and \
-                   os.path.isfile(os.path.join(doc_candidate, 'conf.py')):
-                    doc_folder = doc_candidate
-                    break
+    def _fits_time_budget(self, package_name, tag, deadline):
+        """ Find out if a build can be done before ``deadline``
 
-            if doc_folder is None:
-                LOG.info(f'{package_name} at tag {tag} contains no '
-                         'Sphinx docs folder, skipping.')
-                continue
+        The build is expected to take as long as it did the last time.
+        """
+        if deadline is None:
+            return True
+        record = self.state.get(self._target_name(package_name, tag))
+        expected = (record or {}).get('duration') or 0
+        return time.monotonic() + expected <= deadline
 
-            build_folder = os.path.join(doc_folder, '.build')
-            shutil.rmtree(build_folder, ignore_errors=True)
-            os.mkdir(build_folder)
-            html_output_folder = os.path.join(build_folder, 'html')
-            old_sys_path = sys.path
+    def start_html_build(self, package_name, tag):
+        """ Check out a branch or tag and hand its Sphinx build to a worker
 
-            req = pkg_resources.Requirement.parse(package_name)
-            distribution = pkg_resources.working_set.find(req)
-            if distribution is not None:
-                distribution.activate()
-            else:
-                pkg_resources.working_set.add_entry(package_path)
+        Returns the running build, pass it to ``finish_html_builds`` in a
+        list. Returns None if there is nothing to wait for.
+        """
+        package_info = self.packages[package_name]
+        package_path = package_info['path']
+        main_branch = package_info['main_branch']
+        rcs = self.get_client(package_info['vcs'])
+        target_name = self._target_name(package_name, tag)
+        html_path = os.path.join(self.options.htmldir, target_name)
+        commit_id = package_info['commits'].get(tag)
+        inputs = self._get_build_inputs(commit_id)
 
-            if self.options.verbose and self.options.verbose > 1:
-                output_pipeline = sys.stderr
-            else:
-                output_pipeline = None
+        if tag == main_branch or self.options.build_jobs == 1:
+            source_path = package_path
+            with self.report.span('checkout', package_name, tag):
+                rcs.checkout_tag(package_info['url'], tag, package_path)
+        else:
+            source_path = os.path.join(self.options.workingdir,
+                                       '.worktrees', target_name)
+            with self.report.span('checkout', package_name, tag):
+                rcs.export_tag(package_info['url'], tag, package_path,
+                               source_path)
+
+        doc_folder = None
+        for folder_name in self.options.docs_folders:
+            doc_candidate = os.path.join(source_path, folder_name)
+            if os.path.isdir(doc_candidate) and \
+               os.path.isfile(os.path.join(doc_candidate, 'conf.py')):
+                doc_folder = doc_candidate
+                break
+
+        if doc_folder is None:
+            LOG.info(f'{package_name} at tag {tag} contains no '
+                     'Sphinx docs folder, skipping.')
+            self.state.start(target_name, package_name, tag, commit_id,
+                             inputs, None)
+            self.state.finish(target_name, NO_DOCS)
+            self._remove_export(package_info, source_path)
+            return None
+
+        build_folder = os.path.join(doc_folder, '.build')
+        shutil.rmtree(build_folder, ignore_errors=True)
+        os.mkdir(build_folder)
+        if tag == main_branch:
+            doctree_folder = self._get_doctree_cache(package_name, tag,
+                                                     doc_folder)
+        else:
+            doctree_folder = os.path.join(build_folder, 'doctrees')
+        LOG.info(f'(Re)building Sphinx docs for {package_name} {tag}')
+        self.state.start(target_name, package_name, tag, commit_id,
+                         inputs, html_path)
 
+        if self.environments is not None:
             try:
-                with warnings.catch_warnings():
-                    warnings.simplefilter('ignore')
-                    builder = Sphinx(doc_folder,
-                                     doc_folder,
-                                     html_output_folder,
-                                     os.path.join(build_folder, 'doctrees'),
-                                     'html',
-                                     {},
-                                     None,
-                                     warning=output_pipeline,
-                                     freshenv=False,
-                                     warningiserror=False,
-                                     tags=None)
-                LOG.info(f'(Re)building Sphinx docs for {package_name} {tag}')
-                builder.build(True, None)
-                warncount = getattr(builder, '_warncount', 0)
-                if warncount:
-                    LOG.info(f'Sphinx had {warncount} warnings.')
-
-                # Copy HTML to its final resting place
-                if os.path.isdir(html_path):
-                    # This will only ever be true for the main branch, which
-                    # is always regenerated.
-                    shutil.rmtree(html_path)
-
-                shutil.copytree(html_output_folder, html_path)
-
-                package_info['tag_html'][tag] = html_path
-
-            except pkg_resources.DistributionNotFound as e:
-                msg = 'Building Sphinx docs for %s %s failed: missing \
-                       dependency %s'
-                LOG.error(msg % (package_name, tag, str(e)))
+                with self.report.span('environment', package_name, tag):
+                    python, python_path = self._get_environment(
+                                        source_path, doc_folder,
+                                        build_folder)
             except Exception as e:
-                msg = 'Building Sphinx docs for %s %s failed: %s'
-                LOG.error(msg % (package_name, tag, str(e)))
+                self._build_failed(package_name, tag, e)
+                self._remove_export(package_info, source_path)
+                return None
+            html_output_folder = self._new_generation(target_name)
+            build_function = build_in_environment
+            build_args = (python, python_path, doc_folder,
+                          html_output_folder, doctree_folder,
+                          self.options.verbose)
+        else:
+            html_output_folder = self._new_generation(target_name)
+            build_function = build_sphinx
+            build_args = (package_name, source_path, doc_folder,
+                          html_output_folder, doctree_folder,
+                          self.options.verbose)
+
+        if self._build_pool is None:
+            self._build_pool = WorkerPool(
+                            max_workers=self.options.build_jobs,
+                            memory_limit=self.options.worker_memory
+                            * 1024 * 1024,
+                            max_tasks=self.options.worker_builds)
+        future = self._build_pool.submit(build_function, *build_args)
+        if build_function is build_in_environment:
+            # Keep the environment from being evicted while it is used
+            future.add_done_callback(
+                lambda x: self.environments.release(python))
+        build = (package_name, tag, html_path, source_path,
+                 html_output_folder, future)
+        return build
+
+    def finish_html_builds(self, pending):
+        """ Wait for builds started by ``start_html_builds`` and publish them
+        """
+        for (package_name, tag, html_path, source_path, html_output_folder,
+             future) in pending:
+            try:
+                stats = future.result()
+            except Exception as e:
+                self._build_failed(package_name, tag, e)
+                shutil.rmtree(html_output_folder, ignore_errors=True)
+            else:
+                self._publish_html(package_name, tag, html_path,
+                                   html_output_folder, stats)
             finally:
-                sys.path = old_sys_path
+                self._remove_export(self.packages[package_name], source_path)
+
+    def _publish_html(self, package_name, tag, html_path, html_output_folder,
+                      stats):
+        if stats['warnings']:
+            LOG.info(f'Sphinx had {stats["warnings"]} warnings.')
+        LOG.info(f'Building {package_name} {tag} took up to '
+                 f'{stats["peak memory"] // 1048576} MB of memory.')
+        self._report_build(package_name, tag, stats)
+
+        try:
+            with self.report.span('publish', package_name, tag):
+                self._switch_generation(html_path, html_output_folder)
+        except Exception as e:
+            self._build_failed(package_name, tag, e)
+            shutil.rmtree(html_output_folder, ignore_errors=True)
+        else:
+            self.state.finish(os.path.basename(html_path), SUCCESS)
+
+    def _report_build(self, package_name, tag, stats):
+        """ Add the statistics returned by ``build_sphinx`` to the report
+        """
+        for phase in ('sphinx-read', 'sphinx-write'):
+            self.report.add_span(phase, stats[phase], package_name, tag)
+        for name in ('documents read', 'bytes written', 'warnings'):
+            self.report.count(name, stats[name], package_name, tag)
+        self.report.peak('peak memory', stats['peak memory'], package_name,
+                         tag)
+
+    def _new_generation(self, target_name):
+        """ Create an empty staging folder for new HTML output
+
+        Staging folders live inside the HTML output folder, which puts them
+        on the same filesystem as the published output.
+        """
+        generations = os.path.join(self.options.htmldir, GENERATIONS,
+                                   target_name)
+        os.makedirs(generations, exist_ok=True)
+        folder = tempfile.mkdtemp(prefix=time.strftime('%Y%m%d%H%M%S-'),
+                                  dir=generations)
+        os.chmod(folder, 0o755)
+        return folder
+
+    def _switch_generation(self, html_path, html_output_folder):
+        """ Publish a staging folder at ``html_path`` in one step
+
+        ``html_path`` is a symbolic link to the current generation and is
+        replaced atomically, readers never see a partial tree. Older
+        generations are removed afterwards.
+        """
+        link_target = os.path.relpath(html_output_folder,
+                                      os.path.dirname(html_path))
+        tmp_link = f'{html_path}.{os.getpid()}.tmp'
+        if os.path.lexists(tmp_link):
+            # Left behind by a crashed run with the same process ID
+            os.remove(tmp_link)
+        try:
+            os.symlink(link_target, tmp_link)
+        except NotImplementedError:
+            return self._swap_folders(html_path, html_output_folder)
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP,
+                               errno.EOPNOTSUPP):
+                raise
+            return self._swap_folders(html_path, html_output_folder)
+
+        if os.path.isdir(html_path) and not os.path.islink(html_path):
+            # Output published by an older version as a real folder
+            legacy = self._new_generation(os.path.basename(html_path))
+            os.rmdir(legacy)
+            os.rename(html_path, legacy)
+        os.replace(tmp_link, html_path)
+
+        generations = os.path.dirname(html_output_folder)
+        for name in os.listdir(generations):
+            path = os.path.join(generations, name)
+            if path != html_output_folder:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _swap_folders(self, html_path, html_output_folder):
+        """ Publish without symbolic links, for platforms that lack them
+
+        The old output is moved aside first and removed after the new
+        output is in place, which keeps the gap as short as possible.
+        """
+        old_path = None
+        if os.path.islink(html_path):
+            os.remove(html_path)
+        elif os.path.isdir(html_path):
+            old_path = tempfile.mkdtemp(prefix=f'{html_path}.',
+                                        suffix='.old')
+            os.rmdir(old_path)
+            os.rename(html_path, old_path)
+        os.rename(html_output_folder, html_path)
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    def precompress(self):
+        """ Write compressed copies of new or changed published files
+
+        Compression runs in up to ``--build-jobs`` processes.
+        """
+        precompressor = Precompressor(brotli=self.options.brotli,
+                                      jobs=self.options.build_jobs)
+        store = os.path.join(self.options.htmldir, GENERATIONS, DEDUP_STORE)
+        files, removed, size, compressed_size = precompressor.precompress(
+                                                self.options.htmldir,
+                                                skip={store})
+        self.report.count('files compressed', files)
+        self.report.count('bytes compressed', size)
+        LOG.info(f'Compressed {files} files from {size // 1024} KB to '
+                 f'{compressed_size // 1024} KB. Removed {removed} stale '
+                 'compressed files.')
+
+    def deduplicate(self):
+        """ Hard link identical files in all published HTML output
+
+        Files are linked through a content-addressed store inside the
+        generations folder. Published generations never change, so each
+        is hashed only once and remembered in the build state. Stored
+        files that are no longer linked from any generation are removed.
+        Hashing runs in up to ``--build-jobs`` threads.
+        """
+        generations = os.path.join(self.options.htmldir, GENERATIONS)
+        if not os.path.isdir(generations):
+            return
+
+        deduplicator = Deduplicator(os.path.join(generations, DEDUP_STORE),
+                                    jobs=self.options.build_jobs)
+        done = self.state.get_deduplicated()
+        existing = set()
+        files = saved = 0
+        for target_name in sorted(os.listdir(generations)):
+            target_path = os.path.join(generations, target_name)
+            if target_name == DEDUP_STORE or not os.path.isdir(target_path):
+                continue
+            for name in sorted(os.listdir(target_path)):
+                folder = os.path.join(target_path, name)
+                existing.add(folder)
+                if folder in done or not os.path.isdir(folder):
+                    continue
+                linked, folder_saved = deduplicator.deduplicate(folder)
+                self.state.add_deduplicated(folder, folder_saved)
+                files += linked
+                saved += folder_saved
+
+        self.state.remove_deduplicated(done - existing)
+        removed = deduplicator.collect_garbage()
+        self.report.count('files deduplicated', files)
+        self.report.count('bytes deduplicated', saved)
+        LOG.info(f'Deduplicated {files} files, saving {saved // 1024} KB. '
+                 f'Removed {removed} unused files from the store.')
+
+    def _target_name(self, package_name, tag):
+        """ Get the name of the HTML output folder for a package tag
+        """
+        if tag == self.packages[package_name]['main_branch']:
+            return package_name
+        return f'{package_name}-{tag}'
+
+    def _get_build_inputs(self, commit_id):
+        """ Compute a hash of everything that goes into a build
+
+        These are the commit ID of the sources and the Sphinx version.
+        Returns None if the commit ID is not known.
+        """
+        if not commit_id:
+            return None
+        inputs = json.dumps({'commit': commit_id,
+                             'sphinx': sphinx.__version__}, sort_keys=True)
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+    def _is_built(self, package_name, tag, html_path, commit_id, inputs):
+        """ Find out from the build state if a build can be skipped
+
+        This is the case if the same inputs were built successfully and the
+        output still exists, or if they are known to contain no
+        documentation. Failed builds are only repeated with
+        ``--retry-failed``.
+        """
+        target_name = os.path.basename(html_path)
+        record = self.state.is_current(target_name, inputs)
+        if record is None and \
+           tag != self.packages[package_name]['main_branch'] and \
+           self.state.get(target_name) is None and \
+           os.path.isfile(os.path.join(html_path, 'index.html')):
+            # Published by a version without build state. Tags don't change.
+            self.state.start(target_name, package_name, tag, commit_id,
+                             inputs, html_path)
+            self.state.finish(target_name, SUCCESS)
+            record = self.state.get(target_name)
+
+        if record is None:
+            return False
+
+        if record['status'] == SUCCESS and os.path.isdir(html_path):
+            LOG.info(f'{package_name} {tag} done already, skipping.')
+            return True
+        if record['status'] == NO_DOCS:
+            LOG.info(f'{package_name} at tag {tag} contains no Sphinx docs '
+                     'folder, skipping.')
+            return True
+        if record['status'] == FAILED and not self.options.retry_failed:
+            LOG.warning(f'{package_name} {tag} failed before, skipping. Use '
+                        '--retry-failed to build it again.')
+            return True
+        return False
+
+    def _get_environment(self, source_path, doc_folder, build_folder):
+        """ Get the Python executable and import path for a build
+
+        The environment matches the requirements declared by the checked
+        out sources. The sources themselves are imported from the checkout.
+        """
+        egg_base = os.path.join(build_folder, 'egg-info')
+        requirements = read_requirements(source_path, doc_folder, egg_base)
+        python = self.environments.get_python(requirements)
+        code_path = os.path.join(source_path, 'src')
+        if not os.path.isdir(code_path):
+            code_path = source_path
+        return python, [code_path, egg_base]
+
+    def _get_doctree_cache(self, package_name, branch, doc_folder):
+        """ Get the persistent Sphinx doctree folder for a branch
+
+        Keeping the doctrees between runs lets Sphinx re-read only the
+        documents that changed. The cache is thrown away whenever the
+        Sphinx version or the Sphinx configuration file changes.
+        """
+        cache_path = os.path.join(self.options.workingdir, DOCTREE_CACHE,
+                                  package_name, branch)
+        stamp_path = os.path.join(cache_path, 'docbuilder.stamp')
+        with open(os.path.join(doc_folder, 'conf.py'), 'rb') as fp:
+            conf_hash = hashlib.sha256(fp.read()).hexdigest()
+        stamp = {'sphinx': sphinx.__version__, 'conf': conf_hash}
+
+        cached_stamp = None
+        if os.path.isfile(stamp_path):
+            try:
+                with open(stamp_path) as fp:
+                    cached_stamp = json.load(fp)
+            except ValueError:
+                pass
+
+        if cached_stamp != stamp:
+            if os.path.isdir(cache_path):
+                LOG.info(f'Discarding doctree cache for {package_name} '
+                         f'{branch}')
+            shutil.rmtree(cache_path, ignore_errors=True)
+            os.makedirs(cache_path)
+            with open(stamp_path, 'w') as fp:
+                json.dump(stamp, fp)
+
+        return cache_path
+
+    def _build_failed(self, package_name, tag, exc):
+        if isinstance(exc, ImportError):
+            msg = 'Building Sphinx docs for %s %s failed: missing \
+                   dependency %s'
+        else:
+            msg = 'Building Sphinx docs for %s %s failed: %s'
+        LOG.error(msg % (package_name, tag, str(exc)))
+        self.state.finish(self._target_name(package_name, tag), FAILED,
+                          str(exc))
+
+    def _remove_export(self, package_info, source_path):
+        if source_path != package_info['path']:
+            rcs = self.get_client(package_info['vcs'])
+            rcs.remove_export(package_info['path'], source_path)
+
+
+def build_sphinx(package_name, package_path, doc_folder, html_output_folder,
+                 doctree_folder, verbose=None):
+    """ Run Sphinx for a single package checkout in this process
+
+    The package is made importable for the duration of the build, from
+    its installed location if it is installed or from ``package_path``.
+    This is a module-level function so it can be sent to a process pool.
+    Returns the statistics from ``run_sphinx``.
+    """
+    try:
+        from importlib import metadata as importlib_metadata
+    except ImportError:  # pragma: no cover
+        import importlib_metadata
+
+    old_sys_path = list(sys.path)
+    try:
+        distribution = importlib_metadata.distribution(package_name)
+    except importlib_metadata.PackageNotFoundError:
+        location = package_path
+    else:
+        location = str(distribution.locate_file(''))
+    if location not in sys.path:
+        sys.path.append(location)
+
+    try:
+        return run_sphinx(doc_folder, html_output_folder, doctree_folder,
+                          verbose)
+    finally:
+        sys.path[:] = old_sys_path
+
+
+def run_sphinx(doc_folder, html_output_folder, doctree_folder, verbose=None):
+    """ Build the HTML documentation in ``doc_folder``
+
+    Returns a mapping with the Sphinx warning count, the number of
+    documents read, the bytes of HTML output written, the read and write
+    durations in seconds and the peak memory used by the process in bytes.
+    """
+    from sphinx.application import Sphinx
+
+    reset_peak_memory()
+
+    if verbose and verbose > 1:
+        output_pipeline = sys.stderr
+    else:
+        output_pipeline = None
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        builder = Sphinx(doc_folder,
+                         doc_folder,
+                         html_output_folder,
+                         doctree_folder,
+                         'html',
+                         {},
+                         None,
+                         warning=output_pipeline,
+                         freshenv=False,
+                         warningiserror=False,
+                         tags=None)
+    marks = {}
+
+    def before_read(app, env, docnames):
+        marks['read'] = time.monotonic()
+        marks['documents'] = len(docnames)
+
+    def after_read(app, env):
+        marks['write'] = time.monotonic()
+
+    builder.connect('env-before-read-docs', before_read)
+    builder.connect('env-updated', after_read)
+    start = time.monotonic()
+    builder.build(False, None)
+    end = time.monotonic()
+
+    output_bytes = 0
+    for dirpath, dirnames, filenames in os.walk(html_output_folder):
+        for filename in filenames:
+            output_bytes += os.path.getsize(os.path.join(dirpath, filename))
+
+    read_start = marks.get('read', start)
+    write_start = marks.get('write', read_start)
+    return {'warnings': getattr(builder, '_warncount', 0),
+            'documents read': marks.get('documents', 0),
+            'bytes written': output_bytes,
+            'sphinx-read': write_start - read_start,
+            'sphinx-write': end - write_start,
+            'peak memory': peak_memory_usage()}
+
+
+def _command_phase(args):
+    """ Name a command for the report independent of installation paths
+
+    ``/usr/bin/python3.11 -m pip install ...`` becomes ``python -m pip``
+    and ``git fetch -q`` becomes ``git fetch``.
+    """
+    program = os.path.splitext(os.path.basename(args[0]))[0]
+    if program.startswith('python'):
+        program = 'python'
+    if args[1:2] == ['-m']:
+        return ' '.join([program] + args[1:3])
+    return ' '.join([program] + args[1:2])
 
 
 LINK_RST = """\
@@ -0,0 +1,139 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Compressed copies of published files for static web servers
+"""
+
+import gzip
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.xml')
+GZIP = '.gz'
+BROTLI = '.br'
+
+
+def import_brotli():
+    """ Get the ``brotli`` module or None if it is not installed
+    """
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class Precompressor:
+    """ Writes ``.gz`` and ``.br`` files next to text files
+
+    Web servers like nginx with ``gzip_static`` and ``brotli_static`` send
+    these instead of compressing on every request. A compressed file gets
+    the modification time of its source, so a source that is new or was
+    changed is found by comparing both times. Compressed files without a
+    source, or in a format that is not wanted anymore, are removed.
+    """
+
+    def __init__(self, brotli=False, jobs=1):
+        self.suffixes = (GZIP, BROTLI) if brotli else (GZIP,)
+        self.jobs = jobs
+
+    def precompress(self, root, skip=()):
+        """ Compress new and changed files below ``root``
+
+        Folders in ``skip`` are left alone. Returns the number of files
+        compressed, the number of stale compressed files removed and the
+        number of bytes before and after compression.
+        """
+        tasks, stale = self.find_work(root, skip)
+        for path in stale:
+            os.remove(path)
+
+        size = compressed_size = 0
+        if self.jobs > 1 and len(tasks) > 1:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+            else:
+                context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=self.jobs,
+                                     mp_context=context) as pool:
+                results = list(pool.map(_compress_file, tasks, chunksize=16))
+        else:
+            results = [_compress_file(x) for x in tasks]
+
+        for file_size, file_compressed_size in results:
+            size += file_size
+            compressed_size += file_compressed_size
+        return len(tasks), len(stale), size, compressed_size
+
+    def find_work(self, root, skip=()):
+        """ Find the files to compress and the stale compressed files
+
+        Returns a list of ``(path, suffixes)`` tuples and a list of paths.
+        """
+        tasks = []
+        stale = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [x for x in dirnames
+                           if os.path.join(dirpath, x) not in skip]
+            names = set(filenames)
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                source_name, suffix = os.path.splitext(filename)
+                if suffix in (GZIP, BROTLI):
+                    if suffix not in self.suffixes or \
+                       source_name not in names or \
+                       not _is_compressible(source_name):
+                        stale.append(path)
+                    continue
+                if not _is_compressible(filename) or os.path.islink(path):
+                    continue
+
+                mtime = os.stat(path).st_mtime_ns
+                missing = []
+                for suffix in self.suffixes:
+                    if f'{filename}{suffix}' not in names or \
+                       os.stat(f'{path}{suffix}').st_mtime_ns != mtime:
+                        missing.append(suffix)
+                if missing:
+                    tasks.append((path, tuple(missing)))
+        return tasks, stale
+
+
+def _is_compressible(filename):
+    return os.path.splitext(filename)[1].lower() in COMPRESSIBLE
+
+
+def _compress_file(task):
+    """ Write the compressed files for one source file
+    """
+    path, suffixes = task
+    source_stat = os.stat(path)
+    with open(path, 'rb') as fp:
+        data = fp.read()
+
+    compressed_size = 0
+    for suffix in suffixes:
+        if suffix == BROTLI:
+            compressed = import_brotli().compress(data, quality=11)
+        else:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        target = f'{path}{suffix}'
+        tmp_path = f'{target}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(compressed)
+        os.utime(tmp_path, ns=(source_stat.st_atime_ns,
+                               source_stat.st_mtime_ns))
+        os.replace(tmp_path, target)
+        compressed_size += len(compressed)
+    return len(data) * len(suffixes), compressed_size
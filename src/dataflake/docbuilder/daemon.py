@@ -0,0 +1,257 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Long-running documentation builder with polling and push notifications
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import optparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+
+LOG = logging.getLogger()
+
+DAEMON_OPTIONS = (
+  optparse.make_option('--poll-interval',
+                       action='store', dest='poll_interval', type='float',
+                       help='Seconds between checks of all repositories for \
+                             changes, 0 disables polling. Default: 600',
+                       default=600),
+  optparse.make_option('--listen',
+                       action='store', dest='listen',
+                       help='[HOST:]PORT for the HTTP endpoint that accepts \
+                             push notifications. HOST defaults to \
+                             127.0.0.1. Default: no HTTP endpoint'),
+  optparse.make_option('--webhook-secret',
+                       action='store', dest='webhook_secret',
+                       help='Secret that push notifications must be signed \
+                             with or must carry as token'),
+)
+
+
+class RebuildQueue:
+    """ Collects rebuild requests until the builder thread takes them
+
+    Requests for the same package that arrive while a build is running
+    are merged into a single rebuild.
+    """
+
+    def __init__(self):
+        self.stopped = False
+        self._condition = threading.Condition()
+        self._packages = set()
+        self._everything = False
+
+    def request(self, package_names=None):
+        """ Ask for a rebuild of ``package_names``, or of all packages
+        """
+        with self._condition:
+            if package_names is None:
+                self._everything = True
+            else:
+                self._packages.update(package_names)
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self.stopped = True
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """ Wait for rebuild requests and take all of them
+
+        Returns a set of package names or None if all packages should be
+        rebuilt. An empty set means the timeout has passed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: (self._packages or
+                                              self._everything or
+                                              self.stopped), timeout)
+            if self._everything:
+                package_names = None
+            else:
+                package_names = set(self._packages)
+            self._packages.clear()
+            self._everything = False
+        return package_names
+
+
+class DocsDaemon:
+    """ Keeps a ``DocsBuilder`` running and rebuilds packages on demand
+
+    All packages are checked for changes every ``--poll-interval``
+    seconds. With ``--listen`` an HTTP server accepts push notifications:
+
+    - ``POST /rebuild/<package name>`` rebuilds a single package
+    - ``POST /`` with a GitHub or GitLab push event as JSON body rebuilds
+      the package whose repository was pushed to
+
+    Each rebuild is followed by an update of the index pages.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.options = builder.options
+        self.queue = RebuildQueue()
+        self.server = None
+        self.package_names = set()
+        for vcs, url in builder.get_sources():
+            rcs = builder.get_client(vcs)
+            self.package_names.add(rcs.name_from_url(url))
+
+    def run(self):
+        """ Build all packages and keep rebuilding them until stopped
+        """
+        if self.options.listen:
+            self.start_server(self.options.listen)
+
+        self.queue.request()
+        next_poll = time.monotonic()
+        try:
+            while not self.queue.stopped:
+                timeout = None
+                if self.options.poll_interval:
+                    timeout = max(next_poll - time.monotonic(), 0)
+                package_names = self.queue.get(timeout)
+                if self.queue.stopped:
+                    break
+
+                if package_names:
+                    names = ', '.join(sorted(package_names))
+                    LOG.info(f'Rebuilding {names}')
+                else:
+                    package_names = None
+                    next_poll = time.monotonic() + self.options.poll_interval
+                try:
+                    self.builder.run(package_names)
+                except Exception:
+                    LOG.exception('Documentation build failed')
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.queue.stop()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def start_server(self, listen):
+        """ Serve push notifications on ``[HOST:]PORT`` in a thread
+        """
+        host, _, port = listen.rpartition(':')
+        self.server = ThreadingHTTPServer((host or '127.0.0.1', int(port)),
+                                          WebhookHandler)
+        self.server.docs_daemon = self
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  name='docbuilder-http', daemon=True)
+        thread.start()
+        LOG.info('Listening for push notifications on %s:%s' %
+                 self.server.server_address[:2])
+
+    def find_packages(self, payload):
+        """ Get the names of known packages mentioned in a push event
+        """
+        candidates = set()
+        for key in ('repository', 'project'):
+            info = payload.get(key)
+            if not isinstance(info, dict):
+                continue
+            candidates.add(info.get('name'))
+            for url_key in ('clone_url', 'ssh_url', 'git_url', 'html_url',
+                            'url', 'git_http_url', 'git_ssh_url',
+                            'web_url', 'path_with_namespace'):
+                url = info.get(url_key)
+                if url:
+                    candidates.add(url.rstrip('/').split('/')[-1])
+
+        wanted = {_strip_git(x) for x in candidates if x}
+        return {x for x in self.package_names if _strip_git(x) in wanted}
+
+    def is_authorized(self, headers, body):
+        """ Check the secret of a push notification if one is configured
+
+        GitHub signs the body with the secret, GitLab and other clients
+        send the secret itself in a header.
+        """
+        secret = self.options.webhook_secret
+        if not secret:
+            return True
+
+        signature = headers.get('X-Hub-Signature-256', '')
+        if signature:
+            digest = hmac.new(secret.encode(), body, hashlib.sha256)
+            return hmac.compare_digest(signature,
+                                       f'sha256={digest.hexdigest()}')
+
+        token = headers.get('X-Gitlab-Token') or \
+            headers.get('X-Docbuilder-Token') or ''
+        return hmac.compare_digest(token.encode(), secret.encode())
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """ Turns HTTP requests into rebuild requests
+    """
+
+    def do_POST(self):
+        daemon = self.server.docs_daemon
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        if not daemon.is_authorized(self.headers, body):
+            return self.respond(403, 'Invalid secret')
+
+        if self.path.startswith('/rebuild/'):
+            package_names = {self.path[len('/rebuild/'):].strip('/')}
+            package_names &= daemon.package_names
+        elif self.headers.get('X-GitHub-Event') == 'ping':
+            return self.respond(200, 'pong')
+        else:
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                return self.respond(400, 'Invalid JSON payload')
+            if not isinstance(payload, dict):
+                return self.respond(400, 'Invalid JSON payload')
+            package_names = daemon.find_packages(payload)
+
+        if not package_names:
+            return self.respond(404, 'Unknown package')
+
+        daemon.queue.request(package_names)
+        self.respond(202, 'Rebuild scheduled: %s' %
+                     ', '.join(sorted(package_names)))
+
+    def respond(self, status, message):
+        data = f'{message}\n'.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        LOG.info('%s - %s' % (self.address_string(), format % args))
+
+
+def _strip_git(name):
+    if name.endswith('.git'):
+        return name[:-len('.git')]
+    return name
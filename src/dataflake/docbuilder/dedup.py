@@ -0,0 +1,96 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Hard link identical files in published HTML output
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Deduplicator:
+    """ Replaces identical files by hard links into a content-addressed store
+
+    Every file is stored once below ``store_path`` under the SHA-256 hash
+    of its content, and every copy is a hard link to it. The store must be
+    on the same filesystem as the folders that are deduplicated. Only use
+    it for folders that are never written to again, otherwise a change to
+    one file would show up in all its copies.
+    """
+
+    def __init__(self, store_path, jobs=1):
+        self.store_path = store_path
+        self.jobs = jobs
+
+    def deduplicate(self, folder):
+        """ Link all files in ``folder`` to the store
+
+        Returns the number of files that were replaced by a link to an
+        identical file and the number of bytes saved that way.
+        """
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if not os.path.islink(path):
+                    paths.append(path)
+
+        if self.jobs > 1 and len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                digests = list(pool.map(_hash_file, paths))
+        else:
+            digests = [_hash_file(x) for x in paths]
+
+        linked = saved = 0
+        for path, digest in zip(paths, digests):
+            object_path = os.path.join(self.store_path, digest[:2], digest)
+            file_stat = os.stat(path)
+            try:
+                object_stat = os.stat(object_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.link(path, object_path)
+                continue
+
+            if object_stat.st_ino == file_stat.st_ino:
+                continue  # Linked already
+            tmp_path = f'{path}.dedup'
+            os.link(object_path, tmp_path)
+            os.replace(tmp_path, path)
+            linked += 1
+            saved += file_stat.st_size
+
+        return linked, saved
+
+    def collect_garbage(self):
+        """ Remove stored files that are not linked from anywhere else
+        """
+        removed = 0
+        if not os.path.isdir(self.store_path):
+            return removed
+
+        for dirpath, dirnames, filenames in os.walk(self.store_path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.stat(path).st_nlink < 2:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,322 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Cached virtual environments for documentation builds
+"""
+
+import collections
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import site
+import sys
+import tempfile
+import threading
+import time
+
+from .utils import run_cmd
+
+
+try:
+    import tomllib
+except ImportError:  # pragma: no cover
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+
+LOG = logging.getLogger()
+MARKER = 'docbuilder-env.json'
+# Changes whenever new environments are set up differently
+LAYOUT = 2
+# Holds the docbuilder's ``sys.path`` for builds inside an environment
+PATH_VARIABLE = 'DOCBUILDER_PATH'
+DOCS_EXTRAS = ('docs', 'doc', 'sphinx')
+REQUIREMENTS_FILES = ('requirements-docs.txt', 'docs-requirements.txt',
+                      'doc-requirements.txt', 'requirements-doc.txt')
+
+
+class BuildEnvironmentError(Exception):
+    """ A build environment could not be created
+    """
+
+
+def read_requirements(source_path, doc_folder, egg_base):
+    """ Collect the requirements a package declares for building its docs
+
+    These are the package dependencies and its ``docs`` extra, read from
+    ``pyproject.toml`` or from the ``egg_info`` metadata created in
+    ``egg_base``, plus the lines of a documentation requirements file. The
+    package itself is not part of the list, it is put on ``sys.path``
+    straight from ``source_path`` during the build.
+    """
+    requirements = []
+    project = None
+    pyproject_path = os.path.join(source_path, 'pyproject.toml')
+    if os.path.isfile(pyproject_path):
+        if tomllib is None:
+            LOG.warning(f'Cannot read {pyproject_path}, please install '
+                        'tomli. Its requirements are not installed.')
+        else:
+            try:
+                with open(pyproject_path, 'rb') as fp:
+                    project = tomllib.load(fp).get('project')
+            except tomllib.TOMLDecodeError as e:
+                LOG.warning(f'Cannot parse {pyproject_path}: {e}. Its '
+                            'requirements are not installed.')
+
+    if project and 'dependencies' not in project.get('dynamic', ()):
+        requirements.extend(project.get('dependencies', ()))
+        for extra, extra_requirements in project.get(
+                                  'optional-dependencies', {}).items():
+            if extra in DOCS_EXTRAS:
+                requirements.extend(extra_requirements)
+    elif os.path.isfile(os.path.join(source_path, 'setup.py')):
+        requirements.extend(_read_egg_requirements(source_path, egg_base))
+
+    candidates = [os.path.join(source_path, x) for x in REQUIREMENTS_FILES]
+    candidates.append(os.path.join(doc_folder, 'requirements.txt'))
+    for path in candidates:
+        if os.path.isfile(path):
+            with open(path) as fp:
+                for line in fp:
+                    line = line.split(' #')[0].strip()
+                    if line and not line.startswith(('#', '-')):
+                        requirements.append(line)
+
+    return sorted(set(requirements))
+
+
+def _read_egg_requirements(source_path, egg_base):
+    os.makedirs(egg_base, exist_ok=True)
+    result = run_cmd((sys.executable, 'setup.py', '-q', 'egg_info',
+                      '--egg-base', egg_base), cwd=source_path)
+    if not result:
+        raise BuildEnvironmentError(result.describe())
+
+    requirements = []
+    section = None
+    for path in glob.glob(os.path.join(egg_base, '*.egg-info',
+                                       'requires.txt')):
+        with open(path) as fp:
+            for line in fp:
+                line = line.strip()
+                if line.startswith('['):
+                    # Extras look like ``[docs]`` or ``[docs:python_version]``
+                    extra, _, marker = line[1:-1].partition(':')
+                    section = (extra, marker)
+                elif not line:
+                    continue
+                elif section is None or not section[0]:
+                    requirements.append(_add_marker(line, section))
+                elif section[0] in DOCS_EXTRAS:
+                    requirements.append(_add_marker(line, section))
+    return requirements
+
+
+def _add_marker(requirement, section):
+    if section is None or not section[1]:
+        return requirement
+    return f'{requirement}; {section[1]}'
+
+
+class EnvironmentCache:
+    """ Virtual environments keyed by a hash of their requirements
+
+    Packages and tags with the same requirements share one environment.
+    Every environment can also import everything available to the
+    docbuilder itself, like `Sphinx` and its extensions, but its own
+    packages take precedence. When the environments take up more than
+    ``budget`` bytes, the least recently used ones are removed, except
+    those that are still in use by a build.
+    """
+
+    def __init__(self, path, budget=None, timeout=None):
+        self.path = path
+        self.budget = budget
+        self.timeout = timeout
+        self.in_use = collections.Counter()
+        self.lock = threading.Lock()
+
+    def get_key(self, requirements):
+        """ Compute the cache key for a list of requirements
+        """
+        data = json.dumps({'python': sys.version, 'layout': LAYOUT,
+                           'requirements': sorted(requirements)})
+        return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+    def get_python(self, requirements):
+        """ Get the Python executable of an environment for ``requirements``
+
+        The environment is created and populated with ``pip`` first if it
+        does not exist yet. It counts as in use until ``release`` is called
+        with the returned executable.
+        """
+        key = self.get_key(requirements)
+        env_path = os.path.join(self.path, key)
+        marker_path = os.path.join(env_path, MARKER)
+
+        with self.lock:
+            self.in_use[key] += 1
+        try:
+            if os.path.isfile(marker_path):
+                os.utime(marker_path)
+            else:
+                self.create(env_path, requirements)
+                self.evict()
+        except BaseException:
+            self.release(_python_path(env_path))
+            raise
+
+        return _python_path(env_path)
+
+    def release(self, python):
+        """ Mark the environment of ``python`` as no longer in use
+        """
+        key = os.path.basename(os.path.dirname(os.path.dirname(python)))
+        with self.lock:
+            self.in_use[key] -= 1
+            if self.in_use[key] <= 0:
+                del self.in_use[key]
+
+    def create(self, env_path, requirements):
+        """ Create a new environment at ``env_path``
+        """
+        LOG.info(f'Creating build environment {env_path}')
+        shutil.rmtree(env_path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        import venv
+        venv.EnvBuilder(with_pip=False).create(env_path)
+        python = _python_path(env_path)
+
+        # Make the docbuilder's own packages, like Sphinx, importable after
+        # the packages installed in the environment. Besides the site
+        # folders this covers the ``sys.path`` of the running docbuilder,
+        # which ``build_in_environment`` passes in ``DOCBUILDER_PATH``.
+        result = run_cmd((python, '-c', 'import site, sys; '
+                          'print(site.getsitepackages()[0])'))
+        env_site = result.output.strip()
+        site_dirs = site.getsitepackages()
+        if site.ENABLE_USER_SITE:
+            site_dirs.append(site.getusersitepackages())
+        with open(os.path.join(env_site, 'docbuilder.pth'), 'w') as fp:
+            fp.write(f'import os, site; list(map(site.addsitedir, '
+                     f'{site_dirs!r} + list(filter(None, os.environ.get('
+                     f'{PATH_VARIABLE!r}, "").split(os.pathsep)))))\n')
+
+        if requirements:
+            result = run_cmd((sys.executable, '-m', 'pip', '--python', python,
+                              'install', '-q', '--disable-pip-version-check')
+                             + tuple(requirements), timeout=self.timeout)
+            if not result:
+                shutil.rmtree(env_path, ignore_errors=True)
+                raise BuildEnvironmentError(result.describe())
+
+        with open(os.path.join(env_path, MARKER), 'w') as fp:
+            json.dump({'requirements': requirements,
+                       'size': _folder_size(env_path),
+                       'created': time.time()}, fp, indent=2)
+
+    def evict(self):
+        """ Remove least recently used environments to stay within budget
+        """
+        if not self.budget or not os.path.isdir(self.path):
+            return
+
+        environments = []
+        for name in os.listdir(self.path):
+            marker_path = os.path.join(self.path, name, MARKER)
+            if not os.path.isfile(marker_path):
+                continue
+            try:
+                with open(marker_path) as fp:
+                    size = json.load(fp)['size']
+            except (KeyError, ValueError):
+                size = _folder_size(os.path.join(self.path, name))
+            environments.append((os.path.getmtime(marker_path), name, size))
+
+        total = sum(x[2] for x in environments)
+        for last_used, name, size in sorted(environments):
+            if total <= self.budget:
+                break
+            with self.lock:
+                if name in self.in_use:
+                    continue
+            LOG.info(f'Removing unused build environment {name}')
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            total -= size
+
+
+def build_in_environment(python, python_path, doc_folder, html_output_folder,
+                         doctree_folder, verbose=None):
+    """ Run Sphinx with the Python executable of a build environment
+
+    ``python_path`` lists folders that are put in front of ``sys.path``,
+    like the package checkout. Everything on the ``sys.path`` of the
+    docbuilder is available after the packages of the environment.
+    Returns the same statistics as ``builder.build_sphinx``.
+    """
+    fd, result_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(python_path))
+        env[PATH_VARIABLE] = os.pathsep.join(
+                                os.path.abspath(x) for x in sys.path if x)
+        args = (python, '-m', 'dataflake.docbuilder.envs', result_path,
+                doc_folder, html_output_folder, doctree_folder,
+                str(verbose or 0))
+        result = run_cmd(args, env=env)
+        if verbose and verbose > 1 and result.error:
+            sys.stderr.write(result.error)
+        if not result:
+            raise BuildEnvironmentError(result.describe())
+        with open(result_path) as fp:
+            return json.load(fp)
+    finally:
+        os.remove(result_path)
+
+
+def _python_path(env_path):
+    if sys.platform == 'win32':
+        return os.path.join(env_path, 'Scripts', 'python.exe')
+    return os.path.join(env_path, 'bin', 'python')
+
+
+def _folder_size(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+    return size
+
+
+def main():
+    """ Entry point for ``build_in_environment`` inside the environment
+    """
+    from .builder import run_sphinx
+
+    result_path, doc_folder, html_output_folder, doctree_folder, \
+        verbose = sys.argv[1:]
+    stats = run_sphinx(doc_folder, html_output_folder, doctree_folder,
+                       int(verbose))
+    with open(result_path, 'w') as fp:
+        json.dump(stats, fp)
+
+
+if __name__ == '__main__':
+    main()
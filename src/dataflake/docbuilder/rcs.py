@@ -13,49 +13,158 @@
 """ Abstracted revision control
 """
 
+import contextlib
+import hashlib
+import io
 import logging
 import os
+import re
+import shutil
+import stat
 import sys
 from urllib.parse import urlparse
 
-from .utils import shell_cmd
+from .utils import run_cmd
+
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# dulwich is optional and slow to import, see ``_import_dulwich``
+porcelain = iter_tree_contents = parse_commit = Repo = None
+
+
+# Never let git wait for credentials on a terminal nobody is watching
+GIT_ENV = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+
+
+class RCSError(Exception):
+    """ A version control operation failed
+    """
+
+
+def version_sort_key(name):
+    """ Sort key that orders version-like names the way ``git`` does
+
+    Runs of digits compare as numbers, so ``1.10`` sorts after ``1.9``.
+    """
+    return [(0, int(x)) if x.isdigit() else (1, x)
+            for x in re.split(r'(\d+)', name)]
+
+
+def _import_dulwich():
+    global porcelain, iter_tree_contents, parse_commit, Repo
+    from dulwich import porcelain
+    from dulwich.object_store import iter_tree_contents
+    from dulwich.objectspec import parse_commit
+    from dulwich.repo import Repo
 
 
 class RCSClient:
     """ RCS client base class.
     """
 
-    def __init__(self, logger=logging.getLogger()):
+    def __init__(self, logger=logging.getLogger(), clone_strategy='full',
+                 timeout=None, mirror_cache=None):
         self.logger = logger
         self.main_branch = None
+        self.clone_strategy = clone_strategy
+        self.timeout = timeout
+        self.mirror_cache = mirror_cache
+        self._metadata = {}
 
     def checkout_or_update(self, url, workingdir, trunk_only=True):
         package_name = self.name_from_url(url)
         package_dir = os.path.join(workingdir, package_name)
-        package_info = {
-            'name': package_name,
-            'url': url,
-            'path': package_dir,
-            'tags': [],
-            'main_branch': self.get_main_branch_name(url, package_dir),
-            }
 
         if os.path.isdir(package_dir):
             self.logger.info(f'Updating {package_name}')
-            current = self.get_current_branch_name(package_dir)
-            main = self.get_main_branch_name(url, package_dir)
-            if current != main:
-                self.checkout_tag(url, main, package_dir)
+            metadata = self.get_metadata(url, package_dir)
+            if metadata['current_branch'] != metadata['main_branch']:
+                self.checkout_tag(url, metadata['main_branch'], package_dir)
             self.update(package_dir)
         else:
             self.logger.info(f'Cloning {package_name}')
             self.checkout(url, package_dir)
 
+        return self.get_package_info(url, workingdir, trunk_only=trunk_only)
+
+    def get_package_info(self, url, workingdir, trunk_only=True):
+        """ Describe an existing checkout without contacting the remote
+        """
+        package_name = self.name_from_url(url)
+        package_dir = os.path.join(workingdir, package_name)
+        metadata = self.get_metadata(url, package_dir)
+        package_info = {
+            'name': package_name,
+            'url': url,
+            'path': package_dir,
+            'tags': [],
+            'main_branch': metadata['main_branch'],
+            'commits': metadata['commits'],
+            }
+
         if not trunk_only:
-            package_info['tags'] = self.get_tag_names(url, package_dir)
+            package_info['tags'] = metadata['tags']
 
         return package_info
 
+    def get_metadata(self, url, checkout_path):
+        """ Get the state of a checkout as a mapping
+
+        The keys are ``main_branch``, ``current_branch``, ``head`` (the
+        commit ID of the checked out revision), ``tags`` (sorted oldest
+        to newest) and ``commits``, which maps branch and tag names to
+        their object IDs.
+
+        Results are cached per checkout path until the checkout is changed
+        through this client.
+        """
+        metadata = self._metadata.get(checkout_path)
+        if metadata is None:
+            metadata = self._read_metadata(url, checkout_path)
+            self._metadata[checkout_path] = metadata
+        return metadata
+
+    def get_local_refs(self, url, checkout_path):
+        """ Get the main branch and tag refs of a checkout
+
+        The format is the same as for ``get_remote_refs``, so both can be
+        compared to find out if a checkout is up to date.
+        """
+        metadata = self.get_metadata(url, checkout_path)
+        commits = metadata['commits']
+        main_branch = metadata['main_branch']
+        refs = {f'refs/tags/{x}': commits.get(x) for x in metadata['tags']}
+        refs[f'refs/heads/{main_branch}'] = commits.get(main_branch)
+        return refs
+
+    def get_remote_refs(self, url, main_branch):
+        """ Ask a remote repository for its main branch and tag refs
+
+        Returns a mapping of full ref names to object IDs, or None if the
+        remote cannot be asked.
+        """
+        return None
+
+    def invalidate_metadata(self, checkout_path):
+        """ Forget cached metadata for a checkout
+        """
+        self._metadata.pop(checkout_path, None)
+
+    def reset_mirrors(self):
+        """ Refresh shared mirrors again the next time they are used
+        """
+
+    def _read_metadata(self, url, checkout_path):
+        return {'main_branch': self.get_main_branch_name(url, checkout_path),
+                'current_branch': self.get_current_branch_name(checkout_path),
+                'head': None,
+                'tags': self.get_tag_names(url, checkout_path),
+                'commits': {}}
+
     def checkout_or_update_tags(self, package_url, package_dir):
         """ Check out or update all package tags
 
@@ -74,10 +183,11 @@ class RCSClient:
         """ Create the EGG_INFO structure in a checkout
         """
         if 'setup.py' in os.listdir(egg_path):
-            pythonpath = ':'.join(sys.path)
-            cmd = (f'PYTHONPATH="{pythonpath}" {sys.executable}'
-                   f' {egg_path}/setup.py egg_info')
-            shell_cmd(cmd, fromwhere=egg_path)
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+            result = run_cmd((sys.executable, 'setup.py', 'egg_info'),
+                             cwd=egg_path, timeout=self.timeout, env=env)
+            if not result:
+                self.logger.error(result.describe())
 
     def name_from_url(self, url):
         """ Determine a package name from its VCS URL
@@ -91,6 +201,12 @@ class RCSClient:
     def checkout_tag(self, url, tag, targetpath):
         raise NotImplementedError()
 
+    def export_tag(self, url, tag, checkout_path, targetpath):
+        raise NotImplementedError()
+
+    def remove_export(self, checkout_path, targetpath):
+        raise NotImplementedError()
+
     def update(self, targetpath):
         raise NotImplementedError()
 
@@ -105,63 +221,420 @@ class RCSClient:
 
 
 class GitClient(RCSClient):
+    """ Git client
 
-    def __init__(self, logger=logging.getLogger()):
-        super().__init__(logger=logging.getLogger())
-        version_output = shell_cmd('git --version')
+    The ``clone_strategy`` decides how much of a repository is downloaded:
+
+    - ``full``: the complete history with all objects
+    - ``blobless``: the complete history, but file contents are only
+      downloaded when a commit is checked out
+    - ``shallow``: only the newest commit of the main branch, tags are
+      fetched one by one when they are checked out
+
+    Every ``git`` call is aborted after ``timeout`` seconds if it is set.
+
+    With a ``mirror_cache`` folder, one bare mirror of every repository is
+    kept there and refreshed once per run. Checkouts are cloned from the
+    mirror and borrow its objects instead of copying them, so they take
+    almost no time and space. The mirror cache can be shared by several
+    working directories and machines. Mirrors are always full clones.
+    """
+
+    def __init__(self, logger=logging.getLogger(), clone_strategy='full',
+                 timeout=None, mirror_cache=None):
+        if mirror_cache and clone_strategy != 'full':
+            logger.warning(f'Clone strategy {clone_strategy} is not '
+                           'supported with a mirror cache, using full '
+                           'clones.')
+            clone_strategy = 'full'
+        super().__init__(logger=logger, clone_strategy=clone_strategy,
+                         timeout=timeout, mirror_cache=mirror_cache)
+        version_output = self._git('--version').output
         self.version = version_output.split()[-1]
+        self.version_info = tuple(int(x) for x in
+                                  re.findall(r'\d+', self.version)[:3])
+        self._mirrored = set()
+
+    def _git(self, *args, cwd=None, check=False):
+        """ Run ``git`` with the given arguments
+
+        Failures are logged, or raised as ``RCSError`` if ``check`` is set.
+        """
+        result = run_cmd(('git',) + args, cwd=cwd, timeout=self.timeout,
+                         env=GIT_ENV)
+        if not result:
+            if check:
+                raise RCSError(result.describe())
+            self.logger.error(result.describe())
+        return result
 
     def update(self, checkout_path):
         """ Update an existing checkout
         """
-        shell_cmd('git fetch -q --all && git pull', fromwhere=checkout_path)
+        self.invalidate_metadata(checkout_path)
+        if self.clone_strategy == 'shallow':
+            # A shallow history cannot be merged, move to the new tip instead
+            if self._git('fetch', '-q', '--depth', '1', cwd=checkout_path):
+                self._git('reset', '-q', '--hard', '@{u}', cwd=checkout_path)
+        elif self._git('fetch', '-q', '--all', cwd=checkout_path):
+            self._git('pull', '-q', cwd=checkout_path)
+
+    def checkout_or_update(self, url, workingdir, trunk_only=True):
+        if self.mirror_cache:
+            mirror_path = self.refresh_mirror(url)
+            checkout_path = os.path.join(workingdir, self.name_from_url(url))
+            if os.path.isdir(checkout_path):
+                self._borrow_from_mirror(checkout_path, mirror_path)
+        return super().checkout_or_update(url, workingdir,
+                                          trunk_only=trunk_only)
 
     def checkout(self, url, checkout_path):
         """ Check out from a repository
         """
-        shell_cmd(f'git clone -q {url} {checkout_path}')
+        if self.mirror_cache:
+            url = self.refresh_mirror(url)
+            options = ('--shared',)
+        elif self.clone_strategy == 'blobless':
+            options = ('--filter=blob:none',)
+        elif self.clone_strategy == 'shallow':
+            options = ('--depth', '1', '--no-tags')
+        else:
+            options = ()
+        self.invalidate_metadata(checkout_path)
+        self._git('clone', '-q', *options, url, checkout_path, check=True)
         # Silence warnings
-        shell_cmd('git config --local advice.detachedHead "false"',
-                  fromwhere=checkout_path)
+        self._git('config', '--local', 'advice.detachedHead', 'false',
+                  cwd=checkout_path)
+
+    def get_mirror_path(self, url):
+        """ Get the path of the shared mirror for a repository URL
+        """
+        digest = hashlib.sha256(url.encode()).hexdigest()[:12]
+        return os.path.join(self.mirror_cache,
+                            f'{self.name_from_url(url)}-{digest}')
+
+    def refresh_mirror(self, url):
+        """ Create or update the shared mirror of ``url``
+
+        A mirror is only fetched once per run, see ``reset_mirrors``.
+        Other processes using the same mirror cache wait while a mirror is
+        changed. Returns the mirror path.
+        """
+        mirror_path = self.get_mirror_path(url)
+        if mirror_path in self._mirrored:
+            return mirror_path
+
+        os.makedirs(self.mirror_cache, exist_ok=True)
+        with _locked(f'{mirror_path}.lock'):
+            if os.path.isdir(mirror_path):
+                self.logger.info(f'Updating mirror {mirror_path}')
+                self._git('fetch', '-q', '--prune', cwd=mirror_path)
+            else:
+                self.logger.info(f'Creating mirror {mirror_path}')
+                tmp_path = f'{mirror_path}.tmp'
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                try:
+                    self._git('clone', '-q', '--mirror', url, tmp_path,
+                              check=True)
+                    # Checkouts borrow objects, they must never be pruned
+                    self._git('config', 'gc.auto', '0', cwd=tmp_path,
+                              check=True)
+                except RCSError:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    raise
+                os.rename(tmp_path, mirror_path)
+        self._mirrored.add(mirror_path)
+        return mirror_path
+
+    def reset_mirrors(self):
+        self._mirrored.clear()
+
+    def _borrow_from_mirror(self, checkout_path, mirror_path):
+        """ Make an existing checkout fetch from and borrow from a mirror
+        """
+        result = self._git('remote', 'get-url', 'origin', cwd=checkout_path)
+        if result.output.strip() == mirror_path:
+            return
+
+        alternates_path = os.path.join(checkout_path, '.git', 'objects',
+                                       'info', 'alternates')
+        os.makedirs(os.path.dirname(alternates_path), exist_ok=True)
+        with open(alternates_path, 'a') as fp:
+            fp.write(f'{os.path.join(os.path.abspath(mirror_path), "objects")}'
+                     '\n')
+        self._git('remote', 'set-url', 'origin', mirror_path,
+                  cwd=checkout_path, check=True)
 
     def checkout_tag(self, url, tag, checkout_path):
         """ Check out a specific tag
         """
-        shell_cmd(f'git checkout -q {tag}', fromwhere=checkout_path)
+        self.invalidate_metadata(checkout_path)
+        self._fetch_missing_tag(tag, checkout_path)
+        self._git('checkout', '-q', tag, cwd=checkout_path)
+
+    def export_tag(self, url, tag, checkout_path, targetpath):
+        """ Materialize a tag as separate worktree of an existing checkout
+        """
+        self.remove_export(checkout_path, targetpath)
+        self._fetch_missing_tag(tag, checkout_path)
+        self._git('worktree', 'add', '-q', '--detach', '-f', targetpath, tag,
+                  cwd=checkout_path, check=True)
+
+    def remove_export(self, checkout_path, targetpath):
+        """ Remove a worktree created by ``export_tag``
+        """
+        if os.path.isdir(targetpath):
+            self._git('worktree', 'remove', '--force', targetpath,
+                      cwd=checkout_path)
+            shutil.rmtree(targetpath, ignore_errors=True)
+        self._git('worktree', 'prune', cwd=checkout_path)
 
     def get_tag_names(self, url, checkout_path):
         """ Get all tag names from a repository URL
 
-        ``git tag`` is doing the sorting here.
+        ``git`` is doing the sorting here.
         """
-        tags = []
-        if self.version < '2':
-            cmd = 'git tag'
+        return self.get_metadata(url, checkout_path)['tags']
+
+    def _read_metadata(self, url, checkout_path):
+        """ Read all branch and tag information with a single ``git`` call
+        """
+        if not os.path.isdir(checkout_path):
+            self.checkout(url, checkout_path)
+
+        metadata = {'main_branch': None,
+                    'current_branch': None,
+                    'head': None,
+                    'tags': [],
+                    'commits': {}}
+        fields = '%00'.join(('%(refname)', '%(HEAD)', '%(objectname)',
+                             '%(symref)'))
+        if self.version_info < (2,):
+            sort = ()
         else:
-            cmd = 'git tag --sort=version:refname'
-        output = shell_cmd(cmd, fromwhere=checkout_path)
-        if output:
-            for line in output.split():
-                tags.append(line.strip())
-        return tags
+            sort = ('--sort=version:refname',)
+        result = self._git('for-each-ref', *sort, f'--format={fields}',
+                           'refs/heads', 'refs/tags',
+                           'refs/remotes/origin/HEAD', cwd=checkout_path)
+
+        for line in result.output.splitlines():
+            refname, is_head, objectname, symref = line.split('\0')
+            if refname == 'refs/remotes/origin/HEAD':
+                metadata['main_branch'] = symref.split('/')[-1]
+            elif refname.startswith('refs/tags/'):
+                tag = refname[len('refs/tags/'):]
+                metadata['tags'].append(tag)
+                metadata['commits'][tag] = objectname
+            else:
+                branch = refname[len('refs/heads/'):]
+                metadata['commits'][branch] = objectname
+                if is_head == '*':
+                    metadata['current_branch'] = branch
+                    metadata['head'] = objectname
+
+        if metadata['head'] is None:
+            # Detached HEAD, e.g. after checking out a tag
+            result = self._git('rev-parse', 'HEAD', cwd=checkout_path)
+            metadata['head'] = result.output.strip() or None
+
+        if self.clone_strategy == 'shallow':
+            # Shallow clones only contain the tags that were checked out.
+            # ``ls-remote --sort`` needs git 2.18, so sort them here.
+            tags = []
+            result = self._git('ls-remote', '-q', '--tags', '--refs',
+                               cwd=checkout_path)
+            for line in result.output.splitlines():
+                objectname, refname = line.split()
+                tag = refname.replace('refs/tags/', '', 1)
+                tags.append(tag)
+                metadata['commits'][tag] = objectname
+            metadata['tags'] = sorted(tags, key=version_sort_key)
+
+        return metadata
+
+    def _fetch_missing_tag(self, tag, checkout_path):
+        """ Fetch a single tag into a shallow clone if it is not there yet
+        """
+        if self.clone_strategy != 'shallow':
+            return
+        result = self._git('for-each-ref', f'refs/tags/{tag}',
+                           f'refs/heads/{tag}', cwd=checkout_path)
+        if not result.output:
+            self._git('fetch', '-q', '--depth', '1', 'origin', 'tag', tag,
+                      cwd=checkout_path)
 
     def get_main_branch_name(self, url, checkout_path):
         """ Get the main of the main development branch
         """
+        return self.get_metadata(url, checkout_path)['main_branch']
+
+    def get_current_branch_name(self, checkout_path):
+        """ Get the current branch name
+        """
+        return self.get_metadata(None, checkout_path)['current_branch']
+
+    def get_remote_refs(self, url, main_branch):
+        """ Ask a remote repository for its main branch and tag refs
+
+        This is a single ``git ls-remote`` call that downloads no objects.
+        """
+        result = self._git('ls-remote', '-q', '--refs', url,
+                           f'refs/heads/{main_branch}', 'refs/tags/*')
+        if not result:
+            return None
+
+        refs = {}
+        for line in result.output.splitlines():
+            objectname, refname = line.split()
+            refs[refname] = objectname
+        return refs
+
+
+class DulwichClient(RCSClient):
+    """ Git client working in-process through the ``dulwich`` library
+
+    Requires the optional ``dulwich`` dependency. Only full clones are
+    supported, and the ``timeout`` setting is ignored.
+    """
+
+    def __init__(self, logger=logging.getLogger(), clone_strategy='full',
+                 timeout=None, mirror_cache=None):
+        try:
+            _import_dulwich()
+        except ImportError:
+            raise RCSError('The dulwich package is not installed.')
+        super().__init__(logger=logger, clone_strategy=clone_strategy,
+                         timeout=timeout)
+        if mirror_cache:
+            self.logger.warning('A mirror cache is not supported by dulwich.')
+        if clone_strategy != 'full':
+            self.logger.warning(f'Clone strategy {clone_strategy} is not '
+                                'supported by dulwich, using full clones.')
+
+    def update(self, checkout_path):
+        """ Update an existing checkout
+        """
+        self.invalidate_metadata(checkout_path)
+        with Repo(checkout_path) as repo:
+            porcelain.pull(repo, outstream=io.BytesIO(),
+                           errstream=io.BytesIO())
+
+    def checkout(self, url, checkout_path):
+        """ Check out from a repository
+        """
+        self.invalidate_metadata(checkout_path)
+        try:
+            repo = porcelain.clone(url, checkout_path,
+                                   errstream=io.BytesIO())
+        except Exception as e:
+            shutil.rmtree(checkout_path, ignore_errors=True)
+            raise RCSError(f'Cloning {url} failed: {e}')
+        repo.close()
+
+    def get_remote_refs(self, url, main_branch):
+        """ Ask a remote repository for its main branch and tag refs
+        """
+        try:
+            result = porcelain.ls_remote(url)
+        except Exception as e:
+            self.logger.error(f'Listing refs of {url} failed: {e}')
+            return None
+
+        refs = {}
+        main_ref = f'refs/heads/{main_branch}'
+        for refname, objectname in getattr(result, 'refs', result).items():
+            refname = refname.decode()
+            if refname == main_ref or (refname.startswith('refs/tags/') and
+                                       not refname.endswith('^{}')):
+                refs[refname] = objectname.decode()
+        return refs
+
+    def checkout_tag(self, url, tag, checkout_path):
+        """ Check out a specific tag
+        """
+        self.invalidate_metadata(checkout_path)
+        with Repo(checkout_path) as repo:
+            porcelain.checkout(repo, tag, force=True)
+
+    def export_tag(self, url, tag, checkout_path, targetpath):
+        """ Write the files of a tag into a separate folder
+        """
+        self.remove_export(checkout_path, targetpath)
+        with Repo(checkout_path) as repo:
+            tree_id = parse_commit(repo, tag).tree
+            for entry in iter_tree_contents(repo.object_store, tree_id):
+                if not (stat.S_ISREG(entry.mode) or
+                        stat.S_ISLNK(entry.mode)):
+                    continue  # Submodules
+                path = os.path.join(targetpath, os.fsdecode(entry.path))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                data = repo.object_store[entry.sha].as_raw_string()
+                if stat.S_ISLNK(entry.mode):
+                    os.symlink(os.fsdecode(data), path)
+                else:
+                    with open(path, 'wb') as fp:
+                        fp.write(data)
+                    if entry.mode & 0o111:
+                        os.chmod(path, 0o755)
+
+    def remove_export(self, checkout_path, targetpath):
+        """ Remove a folder created by ``export_tag``
+        """
+        shutil.rmtree(targetpath, ignore_errors=True)
+
+    def _read_metadata(self, url, checkout_path):
+        """ Read all branch and tag information from the repository refs
+        """
         if not os.path.isdir(checkout_path):
             self.checkout(url, checkout_path)
-        output = shell_cmd('git rev-parse --abbrev-ref origin/HEAD',
-                           fromwhere=checkout_path)
-        if output:
-            return output.strip().split('/')[-1]
+
+        metadata = {'main_branch': None,
+                    'current_branch': None,
+                    'head': None,
+                    'tags': [],
+                    'commits': {}}
+        with Repo(checkout_path) as repo:
+            symrefs = repo.refs.get_symrefs()
+            origin_head = symrefs.get(b'refs/remotes/origin/HEAD')
+            if origin_head:
+                metadata['main_branch'] = origin_head.decode().split('/')[-1]
+            head_ref = symrefs.get(b'HEAD', b'')
+            if head_ref.startswith(b'refs/heads/'):
+                branch = head_ref[len(b'refs/heads/'):].decode()
+                metadata['current_branch'] = branch
+                if metadata['main_branch'] is None:
+                    metadata['main_branch'] = branch
+            metadata['head'] = repo.refs[b'HEAD'].decode()
+            for base in (b'refs/heads/', b'refs/tags/'):
+                for name in repo.refs.keys(base=base):
+                    object_id = repo.refs[base + name].decode()
+                    metadata['commits'][name.decode()] = object_id
+            tags = [x.decode() for x in repo.refs.keys(base=b'refs/tags')]
+            metadata['tags'] = sorted(tags, key=version_sort_key)
+
+        return metadata
+
+    def get_tag_names(self, url, checkout_path):
+        """ Get all tag names from a repository URL
+        """
+        return self.get_metadata(url, checkout_path)['tags']
+
+    def get_main_branch_name(self, url, checkout_path):
+        """ Get the main of the main development branch
+        """
+        return self.get_metadata(url, checkout_path)['main_branch']
 
     def get_current_branch_name(self, checkout_path):
         """ Get the current branch name
         """
-        if self.version < '2':
-            output = shell_cmd('git branch', fromwhere=checkout_path)
-            for line in output.split('\n'):
-                if line.strip().startswith('*'):
-                    return line.split()[-1].strip()
+        return self.get_metadata(None, checkout_path)['current_branch']
 
-        return shell_cmd('git branch --show-current', fromwhere=checkout_path)
+
+@contextlib.contextmanager
+def _locked(lock_path):
+    """ Hold an exclusive lock on ``lock_path`` for other processes
+    """
+    with open(lock_path, 'a') as fp:
+        if fcntl is not None:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+        yield
@@ -0,0 +1,158 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Timing and statistics report for a documentation build run
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class BuildReport:
+    """ Collects timed spans and counters while the builder runs
+
+    A span is the duration of one phase, like ``sync`` or ``sphinx-read``,
+    optionally for a given package and tag. Spans marked as ``detail``
+    happen inside other spans, e.g. single ``git`` commands, so they are
+    not added to the package duration. Counters add up numbers such as
+    documents read or bytes written, peaks keep the highest value of
+    measurements like memory usage. Spans, counters and peaks can be
+    recorded from several threads at once.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.spans = []
+        self.counts = []
+        self.peaks = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, phase, package=None, tag=None):
+        """ Time the code inside a ``with`` block as phase ``phase``
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(phase, time.monotonic() - start, package, tag)
+
+    def add_span(self, phase, duration, package=None, tag=None,
+                 detail=False):
+        """ Record a phase duration that was measured elsewhere
+        """
+        with self._lock:
+            self.spans.append({'phase': phase,
+                               'package': package,
+                               'tag': tag,
+                               'duration': duration,
+                               'detail': detail})
+
+    def count(self, name, value=1, package=None, tag=None):
+        """ Add ``value`` to the counter ``name``
+        """
+        with self._lock:
+            self.counts.append({'name': name,
+                                'package': package,
+                                'tag': tag,
+                                'value': value})
+
+    def peak(self, name, value, package=None, tag=None):
+        """ Record a measurement of which only the highest value counts
+        """
+        with self._lock:
+            self.peaks.append({'name': name,
+                               'package': package,
+                               'tag': tag,
+                               'value': value})
+
+    def finish(self):
+        self.finished = time.time()
+
+    def as_dict(self):
+        """ Summarize all spans and counters in a JSON-compatible mapping
+
+        Phase durations and counters are added up for the whole run and
+        for every package, packages are ordered slowest first. Peaks are
+        the highest values for the whole run, every package and every
+        package tag.
+        """
+        totals = {'phases': {}, 'counts': {}, 'peaks': {}}
+        packages = {}
+
+        with self._lock:
+            spans = list(self.spans)
+            counts = list(self.counts)
+            peaks = list(self.peaks)
+
+        for span in spans:
+            _add(totals['phases'], span['phase'], span['duration'])
+            if span['package'] is None:
+                continue
+            package = packages.setdefault(span['package'], _new_package())
+            if not span['detail']:
+                package['duration'] += span['duration']
+            _add(package['phases'], span['phase'], span['duration'])
+            if span['tag'] is not None:
+                tag = package['tags'].setdefault(span['tag'], {})
+                _add(tag, span['phase'], span['duration'])
+
+        for count in counts:
+            _add(totals['counts'], count['name'], count['value'])
+            if count['package'] is not None:
+                package = packages.setdefault(count['package'],
+                                              _new_package())
+                _add(package['counts'], count['name'], count['value'])
+
+        for peak in peaks:
+            _max(totals['peaks'], peak['name'], peak['value'])
+            if peak['package'] is None:
+                continue
+            package = packages.setdefault(peak['package'], _new_package())
+            _max(package['peaks'], peak['name'], peak['value'])
+            if peak['tag'] is not None:
+                tag = package['tag peaks'].setdefault(peak['tag'], {})
+                _max(tag, peak['name'], peak['value'])
+
+        finished = self.finished or time.time()
+        by_duration = sorted(packages.items(), key=lambda x: -x[1]['duration'])
+        return {'started': self.started,
+                'finished': finished,
+                'duration': finished - self.started,
+                'totals': totals,
+                'packages': dict(by_duration),
+                'spans': spans}
+
+    def write(self, path):
+        """ Write the report as JSON file
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.as_dict(), fp, indent=2)
+        os.replace(tmp_path, path)
+
+
+def _add(mapping, key, value):
+    mapping[key] = mapping.get(key, 0) + value
+
+
+def _max(mapping, key, value):
+    mapping[key] = max(mapping.get(key, value), value)
+
+
+def _new_package():
+    return {'duration': 0.0, 'phases': {}, 'counts': {}, 'tags': {},
+            'peaks': {}, 'tag peaks': {}}
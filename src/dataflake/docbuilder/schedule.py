@@ -0,0 +1,48 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Order in which documentation builds are started
+"""
+
+import heapq
+import itertools
+
+
+class BuildSchedule:
+    """ Builds waiting to be started, most important first
+
+    Every build has a rank within its package: 0 for the main branch, 1
+    for the newest tag, 2 for the tag before it and so on. Builds with
+    a lower rank go first, so all main branches are built before any
+    tag, and the newest tags of all packages before older ones. The rank
+    is divided by the package weight from ``weights``, which defaults
+    to 1, so the tags of a package with weight 2 are built twice as
+    early. Builds of the same priority keep the order they were added in.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights or {}
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, package_name, tag, rank):
+        weight = self.weights.get(package_name, 1.0)
+        heapq.heappush(self._heap, (rank / weight, -weight,
+                                    next(self._counter), package_name, tag))
+
+    def pop(self):
+        """ Remove the most important build and return package and tag
+        """
+        return heapq.heappop(self._heap)[-2:]
@@ -0,0 +1,157 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Persistent record of documentation builds
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+BUILDING = 'building'
+SUCCESS = 'success'
+FAILED = 'failed'
+NO_DOCS = 'nodocs'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS remotes (
+    url TEXT PRIMARY KEY,
+    refs TEXT NOT NULL,
+    checked REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS builds (
+    target TEXT PRIMARY KEY,
+    package TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    commit_id TEXT,
+    inputs TEXT,
+    output TEXT,
+    status TEXT NOT NULL,
+    message TEXT,
+    started REAL NOT NULL,
+    duration REAL
+);
+CREATE TABLE IF NOT EXISTS deduplicated (
+    path TEXT PRIMARY KEY,
+    saved INTEGER NOT NULL,
+    finished REAL NOT NULL
+);
+"""
+
+
+class BuildState:
+    """ SQLite database with the outcome of every documentation build
+
+    There is one row per build target, which is a package branch or tag.
+    It records the commit that was built, a hash of all build inputs, the
+    published output path, the status, the time the build started and how
+    long it took. A build is marked ``building`` before it starts, so a
+    run that was interrupted leaves unfinished builds behind that the next
+    run will redo, while finished builds are kept.
+
+    The refs of each remote repository as seen after the last update are
+    stored as well, to find out cheaply if a repository has changed, and
+    the published output folders that have been deduplicated already.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(SCHEMA)
+
+    def get(self, target):
+        """ Get the build record for ``target`` as mapping or None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT * FROM builds WHERE target = ?',
+                                   (target,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def is_current(self, target, inputs):
+        """ Get the build record if it was finished with the same inputs
+        """
+        record = self.get(target)
+        if record is None or inputs is None or record['inputs'] != inputs:
+            return None
+        if record['status'] == BUILDING:
+            return None
+        return record
+
+    def start(self, target, package, ref, commit_id, inputs, output):
+        """ Mark ``target`` as being built
+        """
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO builds (target, package, ref, '
+                'commit_id, inputs, output, status, started) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (target, package, ref, commit_id, inputs, output, BUILDING,
+                 time.time()))
+
+    def finish(self, target, status, message=None):
+        """ Record the outcome of a build started with ``start``
+        """
+        with self._lock:
+            self._db.execute(
+                'UPDATE builds SET status = ?, message = ?, '
+                'duration = ? - started WHERE target = ?',
+                (status, message, time.time(), target))
+
+    def get_refs(self, url):
+        """ Get the refs recorded for a repository URL as mapping or None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT refs FROM remotes WHERE url = ?',
+                                   (url,)).fetchone()
+        return json.loads(row['refs']) if row is not None else None
+
+    def set_refs(self, url, refs):
+        """ Record the refs of a repository URL
+        """
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO remotes (url, refs, checked) '
+                'VALUES (?, ?, ?)',
+                (url, json.dumps(refs, sort_keys=True), time.time()))
+
+    def get_deduplicated(self):
+        """ Get the set of output folders that were deduplicated
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT path FROM deduplicated')
+            return {row['path'] for row in rows}
+
+    def add_deduplicated(self, path, saved):
+        """ Record that ``path`` was deduplicated, saving ``saved`` bytes
+        """
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO deduplicated (path, saved, finished) '
+                'VALUES (?, ?, ?)', (path, saved, time.time()))
+
+    def remove_deduplicated(self, paths):
+        """ Forget output folders that no longer exist
+        """
+        with self._lock:
+            self._db.executemany('DELETE FROM deduplicated WHERE path = ?',
+                                 [(x,) for x in paths])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,89 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Selection of the tags that get built
+"""
+
+import logging
+import re
+
+from packaging.version import InvalidVersion
+from packaging.version import Version
+
+
+LOG = logging.getLogger()
+
+
+class TagSelector:
+    """ Picks the release tags worth building from all tags of a package
+
+    Only tags that are valid :pep:`440` versions are considered, which
+    leaves out tags like ``pre-merge-foo``. A leading ``v`` is allowed.
+    Tags are ordered by version, not by name.
+
+    - ``include`` and ``exclude`` are regular expressions, a tag must
+      match the first and must not match the second. Both are searched
+      anywhere in the tag name.
+
+    - Pre-releases and development releases are skipped unless
+      ``prereleases`` is set.
+
+    - With ``latest_patch`` only the newest release of every
+      ``MAJOR.MINOR`` series is kept.
+    """
+
+    def __init__(self, include=None, exclude=None, prereleases=False,
+                 latest_patch=False):
+        self.include = re.compile(include) if include else None
+        self.exclude = re.compile(exclude) if exclude else None
+        self.prereleases = prereleases
+        self.latest_patch = latest_patch
+
+    def select(self, tag_names):
+        """ Get the selected tags from ``tag_names``, oldest first
+        """
+        versions = []
+        skipped = []
+        for tag_name in tag_names:
+            version = self.parse(tag_name)
+            if version is None or not self.wanted(tag_name, version):
+                skipped.append(tag_name)
+            else:
+                versions.append((version, tag_name))
+        versions.sort()
+
+        if self.latest_patch:
+            series = {}
+            for version, tag_name in versions:
+                series[(version.release + (0,))[:2]] = (version, tag_name)
+            versions = sorted(series.values())
+
+        if skipped:
+            LOG.debug(f'Skipping tags {", ".join(skipped)}')
+        return [tag_name for version, tag_name in versions]
+
+    def parse(self, tag_name):
+        """ Get the version for a tag name or None if it is no version
+        """
+        try:
+            return Version(tag_name)
+        except InvalidVersion:
+            return None
+
+    def wanted(self, tag_name, version):
+        if self.include is not None and not self.include.search(tag_name):
+            return False
+        if self.exclude is not None and self.exclude.search(tag_name):
+            return False
+        if version.is_prerelease and not self.prereleases:
+            return False
+        return True
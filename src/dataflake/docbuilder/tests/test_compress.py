@@ -0,0 +1,81 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the precompression of published output
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..compress import Precompressor
+
+
+class PrecompressorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as fp:
+            fp.write(data)
+        return path
+
+    def test_precompress(self):
+        html = self._write('index.html', '<html>%s</html>' % ('x' * 1000))
+        self._write('logo.png', 'not compressible')
+        precompressor = Precompressor()
+
+        files, removed, size, compressed_size = precompressor.precompress(
+                                                            self.folder)
+        self.assertEqual((files, removed, size), (1, 0, 1013))
+        self.assertLess(compressed_size, size)
+        self.assertEqual(sorted(os.listdir(self.folder)),
+                         ['index.html', 'index.html.gz', 'logo.png'])
+        with gzip.open(f'{html}.gz', 'rt') as fp:
+            self.assertEqual(fp.read(), '<html>%s</html>' % ('x' * 1000))
+        self.assertEqual(os.stat(html).st_mtime_ns,
+                         os.stat(f'{html}.gz').st_mtime_ns)
+
+    def test_only_changed_files(self):
+        html = self._write('index.html', '<html/>')
+        self._write('search.html', '<html/>')
+        precompressor = Precompressor()
+        precompressor.precompress(self.folder)
+
+        self.assertEqual(precompressor.find_work(self.folder), ([], []))
+        self._write('index.html', '<html>changed</html>')
+        os.utime(html, ns=(0, 0))
+        self.assertEqual(precompressor.find_work(self.folder),
+                         ([(html, ('.gz',))], []))
+
+    def test_stale_files(self):
+        self._write('index.html', '<html/>')
+        removed = self._write('removed.html.gz', '')
+        unwanted = self._write('index.html.br', '')
+
+        tasks, stale = Precompressor().find_work(self.folder)
+        self.assertEqual(sorted(stale), sorted([removed, unwanted]))
+
+    def test_skip(self):
+        store = os.path.join(self.folder, '.objects')
+        os.mkdir(store)
+        self._write(os.path.join('.objects', 'index.html'), '<html/>')
+
+        self.assertEqual(Precompressor().find_work(self.folder, skip={store}),
+                         ([], []))
@@ -0,0 +1,161 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the documentation daemon
+"""
+
+import hashlib
+import hmac
+import types
+import unittest
+import urllib.error
+import urllib.request
+
+from ..daemon import DocsDaemon
+from ..daemon import RebuildQueue
+
+
+class RebuildQueueTests(unittest.TestCase):
+
+    def test_timeout(self):
+        self.assertEqual(RebuildQueue().get(timeout=0), set())
+
+    def test_requests_are_merged(self):
+        queue = RebuildQueue()
+        queue.request({'pkg1'})
+        queue.request({'pkg2', 'pkg1'})
+
+        self.assertEqual(queue.get(timeout=0), {'pkg1', 'pkg2'})
+        self.assertEqual(queue.get(timeout=0), set())
+
+    def test_everything(self):
+        queue = RebuildQueue()
+        queue.request({'pkg1'})
+        queue.request()
+
+        self.assertIsNone(queue.get(timeout=0))
+        self.assertEqual(queue.get(timeout=0), set())
+
+    def test_stop(self):
+        queue = RebuildQueue()
+        queue.stop()
+
+        self.assertTrue(queue.stopped)
+        self.assertEqual(queue.get(), set())
+
+
+class DocsDaemonTests(unittest.TestCase):
+
+    def _makeOne(self, secret=None):
+        # Only the parts of the daemon that need no builder
+        daemon = DocsDaemon.__new__(DocsDaemon)
+        daemon.options = types.SimpleNamespace(webhook_secret=secret)
+        daemon.package_names = {'dataflake.docbuilder', 'other'}
+        return daemon
+
+    def test_find_packages_github(self):
+        payload = {'repository': {
+            'name': 'dataflake.docbuilder',
+            'clone_url':
+                'https://github.com/dataflake/dataflake.docbuilder.git'}}
+
+        self.assertEqual(self._makeOne().find_packages(payload),
+                         {'dataflake.docbuilder'})
+
+    def test_find_packages_gitlab(self):
+        payload = {'project': {
+            'path_with_namespace': 'group/other',
+            'git_ssh_url': 'git@gitlab.example.com:group/other.git'}}
+
+        self.assertEqual(self._makeOne().find_packages(payload), {'other'})
+
+    def test_find_packages_unknown(self):
+        payload = {'repository': {'name': 'unknown'}, 'project': 'other'}
+
+        self.assertEqual(self._makeOne().find_packages(payload), set())
+        self.assertEqual(self._makeOne().find_packages({}), set())
+
+    def test_is_authorized_without_secret(self):
+        self.assertTrue(self._makeOne().is_authorized({}, b'{}'))
+
+    def test_is_authorized_github_signature(self):
+        daemon = self._makeOne(secret='s3cr3t')
+        body = b'{"repository": {}}'
+        digest = hmac.new(b's3cr3t', body, hashlib.sha256).hexdigest()
+
+        self.assertTrue(daemon.is_authorized(
+                {'X-Hub-Signature-256': f'sha256={digest}'}, body))
+        self.assertFalse(daemon.is_authorized(
+                {'X-Hub-Signature-256': f'sha256={digest}'}, b'{}'))
+
+    def test_is_authorized_token(self):
+        daemon = self._makeOne(secret='s3cr3t')
+
+        self.assertTrue(daemon.is_authorized(
+                {'X-Gitlab-Token': 's3cr3t'}, b'{}'))
+        self.assertTrue(daemon.is_authorized(
+                {'X-Docbuilder-Token': 's3cr3t'}, b'{}'))
+        self.assertFalse(daemon.is_authorized(
+                {'X-Gitlab-Token': 'wrong'}, b'{}'))
+        self.assertFalse(daemon.is_authorized({}, b'{}'))
+
+
+class WebhookHandlerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon = DocsDaemon.__new__(DocsDaemon)
+        self.daemon.options = types.SimpleNamespace(webhook_secret=None)
+        self.daemon.package_names = {'pkg1', 'pkg2'}
+        self.daemon.queue = RebuildQueue()
+        self.daemon.server = None
+        self.daemon.start_server('127.0.0.1:0')
+        self.addCleanup(self.daemon.stop)
+
+    def _post(self, path, body=b'', headers=None):
+        host, port = self.daemon.server.server_address[:2]
+        request = urllib.request.Request(f'http://{host}:{port}{path}',
+                                         data=body, headers=headers or {},
+                                         method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.close()
+            return e.code
+
+    def test_rebuild_package(self):
+        self.assertEqual(self._post('/rebuild/pkg1'), 202)
+        self.assertEqual(self.daemon.queue.get(timeout=0), {'pkg1'})
+
+    def test_rebuild_unknown_package(self):
+        self.assertEqual(self._post('/rebuild/unknown'), 404)
+        self.assertEqual(self.daemon.queue.get(timeout=0), set())
+
+    def test_push_event(self):
+        body = b'{"repository": {"name": "pkg2"}}'
+
+        self.assertEqual(self._post('/', body), 202)
+        self.assertEqual(self.daemon.queue.get(timeout=0), {'pkg2'})
+
+    def test_invalid_payload(self):
+        self.assertEqual(self._post('/', b'not json'), 400)
+        self.assertEqual(self._post('/', b'[]'), 400)
+
+    def test_ping(self):
+        self.assertEqual(self._post('/', b'{}', {'X-GitHub-Event': 'ping'}),
+                         200)
+
+    def test_invalid_secret(self):
+        self.daemon.options.webhook_secret = 's3cr3t'
+
+        self.assertEqual(self._post('/rebuild/pkg1', b'',
+                                    {'X-Docbuilder-Token': 'wrong'}), 403)
@@ -0,0 +1,74 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the deduplication of published output
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..dedup import Deduplicator
+
+
+class DeduplicatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = os.path.join(self.folder, '.objects')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, path, data):
+        path = os.path.join(self.folder, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            fp.write(data)
+        return path
+
+    def test_identical_files_are_linked(self):
+        first = self._write('a/_static/basic.css', 'body {}')
+        second = self._write('b/_static/basic.css', 'body {}')
+        other = self._write('b/index.html', '<html/>')
+        deduplicator = Deduplicator(self.store)
+
+        self.assertEqual(deduplicator.deduplicate(
+                                os.path.join(self.folder, 'a')), (0, 0))
+        self.assertEqual(deduplicator.deduplicate(
+                                os.path.join(self.folder, 'b')), (1, 7))
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertEqual(os.stat(first).st_nlink, 3)
+        self.assertEqual(os.stat(other).st_nlink, 2)
+        with open(second) as fp:
+            self.assertEqual(fp.read(), 'body {}')
+
+    def test_deduplicate_twice(self):
+        self._write('a/one.txt', 'same')
+        self._write('a/two.txt', 'same')
+        deduplicator = Deduplicator(self.store, jobs=2)
+
+        self.assertEqual(deduplicator.deduplicate(self.folder), (1, 4))
+        self.assertEqual(deduplicator.deduplicate(self.folder), (0, 0))
+
+    def test_collect_garbage(self):
+        path = self._write('a/index.html', '<html/>')
+        deduplicator = Deduplicator(self.store)
+        deduplicator.deduplicate(os.path.join(self.folder, 'a'))
+
+        self.assertEqual(deduplicator.collect_garbage(), 0)
+        os.remove(path)
+        self.assertEqual(deduplicator.collect_garbage(), 1)
+
+    def test_collect_garbage_without_store(self):
+        self.assertEqual(Deduplicator(self.store).collect_garbage(), 0)
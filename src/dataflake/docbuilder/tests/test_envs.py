@@ -0,0 +1,154 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the cached build environments
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..envs import MARKER
+from ..envs import EnvironmentCache
+from ..envs import _python_path
+from ..envs import read_requirements
+from ..envs import tomllib
+
+
+PYPROJECT = """\
+[project]
+name = "example"
+dependencies = ["requests", "zope.interface >= 5"]
+
+[project.optional-dependencies]
+docs = ["sphinx_rtd_theme"]
+test = ["pytest"]
+"""
+
+
+class ReadRequirementsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.doc_folder = os.path.join(self.folder, 'docs')
+        os.mkdir(self.doc_folder)
+        self.egg_base = os.path.join(self.folder, 'egg-info')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, path, text):
+        with open(os.path.join(self.folder, path), 'w') as fp:
+            fp.write(text)
+
+    def _read(self):
+        return read_requirements(self.folder, self.doc_folder, self.egg_base)
+
+    def test_nothing_declared(self):
+        self.assertEqual(self._read(), [])
+
+    @unittest.skipIf(tomllib is None, 'tomli is not installed')
+    def test_pyproject(self):
+        self._write('pyproject.toml', PYPROJECT)
+
+        self.assertEqual(self._read(), ['requests', 'sphinx_rtd_theme',
+                                        'zope.interface >= 5'])
+
+    @unittest.skipIf(tomllib is None, 'tomli is not installed')
+    def test_pyproject_dynamic_dependencies(self):
+        self._write('pyproject.toml', PYPROJECT.replace(
+                        'name = "example"',
+                        'name = "example"\ndynamic = ["dependencies"]'))
+
+        self.assertEqual(self._read(), [])
+
+    @unittest.skipIf(tomllib is None, 'tomli is not installed')
+    def test_pyproject_invalid(self):
+        self._write('pyproject.toml', '[project\n')
+
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(self._read(), [])
+
+    def test_requirements_files(self):
+        self._write('requirements-docs.txt',
+                    '# Comment\nrepoze.sphinx.autointerface\n'
+                    '-e .\n\nsphinx-copybutton  # Copy buttons\n')
+        self._write(os.path.join('docs', 'requirements.txt'),
+                    'sphinx-copybutton\n')
+
+        self.assertEqual(self._read(), ['repoze.sphinx.autointerface',
+                                        'sphinx-copybutton'])
+
+
+class EnvironmentCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _add_environment(self, key, size, last_used):
+        env_path = os.path.join(self.folder, key)
+        os.makedirs(env_path)
+        marker_path = os.path.join(env_path, MARKER)
+        with open(marker_path, 'w') as fp:
+            json.dump({'requirements': [], 'size': size}, fp)
+        os.utime(marker_path, (last_used, last_used))
+        return env_path
+
+    def test_get_key(self):
+        cache = EnvironmentCache(self.folder)
+
+        self.assertEqual(cache.get_key(['a', 'b']), cache.get_key(['b', 'a']))
+        self.assertNotEqual(cache.get_key(['a']), cache.get_key(['a', 'b']))
+
+    def test_get_python_existing(self):
+        cache = EnvironmentCache(self.folder)
+        key = cache.get_key(['a'])
+        env_path = self._add_environment(key, 10, 0)
+
+        python = cache.get_python(['a'])
+        self.assertEqual(python, _python_path(env_path))
+        self.assertEqual(dict(cache.in_use), {key: 1})
+        self.assertGreater(
+            os.path.getmtime(os.path.join(env_path, MARKER)), 0)
+
+        cache.release(python)
+        self.assertEqual(dict(cache.in_use), {})
+
+    def test_evict_least_recently_used(self):
+        cache = EnvironmentCache(self.folder, budget=25)
+        self._add_environment('old', 10, 100)
+        self._add_environment('older', 10, 50)
+        self._add_environment('new', 10, 200)
+
+        cache.evict()
+        self.assertEqual(sorted(os.listdir(self.folder)), ['new', 'old'])
+
+    def test_evict_keeps_environments_in_use(self):
+        cache = EnvironmentCache(self.folder, budget=15)
+        self._add_environment('old', 10, 100)
+        self._add_environment('new', 10, 200)
+        cache.in_use['old'] += 1
+
+        cache.evict()
+        self.assertEqual(os.listdir(self.folder), ['old'])
+
+    def test_evict_without_budget(self):
+        cache = EnvironmentCache(self.folder)
+        self._add_environment('old', 10, 100)
+
+        cache.evict()
+        self.assertEqual(os.listdir(self.folder), ['old'])
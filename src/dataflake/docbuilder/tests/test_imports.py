@@ -0,0 +1,60 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the lazy imports that keep startup fast
+"""
+
+import json
+import os
+import sys
+import unittest
+
+from ..utils import run_cmd
+
+
+# Modules that are only needed when a build is actually running
+HEAVY_MODULES = ('sphinx.application', 'pkg_resources', 'dulwich.porcelain',
+                 'importlib.metadata', 'http.server', 'venv')
+
+CHECK = """\
+import json, sys
+%s
+print(json.dumps(sorted(set(sys.modules) & set(%r))))
+"""
+
+
+class LazyImportTests(unittest.TestCase):
+
+    def _loaded(self, code):
+        """ Get the heavy modules loaded after running ``code``
+        """
+        result = run_cmd((sys.executable, '-c',
+                          CHECK % (code, HEAVY_MODULES)),
+                         env=dict(os.environ,
+                                  PYTHONPATH=os.pathsep.join(sys.path)))
+        self.assertTrue(result, result.describe())
+        return json.loads(result.output)
+
+    def test_package(self):
+        self.assertEqual(self._loaded('import dataflake.docbuilder'), [])
+
+    def test_recipe(self):
+        self.assertEqual(
+            self._loaded('from dataflake.docbuilder import BuildoutScript'),
+            [])
+
+    def test_builder(self):
+        self.assertEqual(
+            self._loaded('import dataflake.docbuilder.builder'), [])
+
+    def test_rcs(self):
+        self.assertEqual(self._loaded('import dataflake.docbuilder.rcs'), [])
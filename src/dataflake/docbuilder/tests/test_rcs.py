@@ -0,0 +1,124 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the version control clients
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import utils
+from ..rcs import GitClient
+from ..rcs import version_sort_key
+from ..utils import run_cmd
+
+
+HAVE_GIT = bool(run_cmd(('git', '--version')))
+
+
+def _git(*args, cwd=None):
+    result = run_cmd(('git', '-c', 'user.name=Test',
+                      '-c', 'user.email=test@example.com') + args, cwd=cwd)
+    if not result:
+        raise RuntimeError(result.describe())
+
+
+class VersionSortKeyTests(unittest.TestCase):
+
+    def test_numbers(self):
+        self.assertEqual(sorted(['1.10', '1.9', '1.9.1', '0.1'],
+                                key=version_sort_key),
+                         ['0.1', '1.9', '1.9.1', '1.10'])
+
+
+@unittest.skipUnless(HAVE_GIT, 'git is not installed')
+class GitMirrorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, 'source', 'package')
+        os.makedirs(self.source)
+        _git('init', '-q', cwd=self.source)
+        with open(os.path.join(self.source, 'README.txt'), 'w') as fp:
+            fp.write('Hello\n')
+        _git('add', 'README.txt', cwd=self.source)
+        _git('commit', '-q', '-m', 'Initial', cwd=self.source)
+        _git('tag', '1.0', cwd=self.source)
+        self.url = f'file://{self.source}'
+        self.mirror_cache = os.path.join(self.folder, 'mirrors')
+        self.workingdir = os.path.join(self.folder, 'work')
+        os.mkdir(self.workingdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _makeOne(self, **kw):
+        return GitClient(mirror_cache=self.mirror_cache, **kw)
+
+    def test_get_mirror_path(self):
+        client = self._makeOne()
+        path = client.get_mirror_path(self.url)
+
+        self.assertEqual(os.path.dirname(path), self.mirror_cache)
+        self.assertTrue(os.path.basename(path).startswith('package-'))
+        self.assertEqual(client.get_mirror_path(self.url), path)
+        self.assertNotEqual(client.get_mirror_path('file:///other/package'),
+                            path)
+
+    def test_clone_strategy_is_full(self):
+        with self.assertLogs(level='WARNING'):
+            client = self._makeOne(clone_strategy='shallow')
+        self.assertEqual(client.clone_strategy, 'full')
+
+    def test_refresh_mirror_once_per_run(self):
+        client = self._makeOne()
+        commands = []
+        utils.command_listeners.append(commands.append)
+        try:
+            mirror_path = client.refresh_mirror(self.url)
+            self.assertTrue(os.path.isdir(mirror_path))
+            count = len(commands)
+            client.refresh_mirror(self.url)
+            self.assertEqual(len(commands), count)
+
+            client.reset_mirrors()
+            client.refresh_mirror(self.url)
+            self.assertEqual(commands[-1].args[1:2], ['fetch'])
+        finally:
+            utils.command_listeners.remove(commands.append)
+
+    def test_checkout_borrows_from_mirror(self):
+        client = self._makeOne()
+        info = client.checkout_or_update(self.url, self.workingdir,
+                                         trunk_only=False)
+
+        mirror_path = client.get_mirror_path(self.url)
+        self.assertEqual(info['tags'], ['1.0'])
+        result = run_cmd(('git', 'remote', 'get-url', 'origin'),
+                         cwd=info['path'])
+        self.assertEqual(result.output.strip(), mirror_path)
+        alternates_path = os.path.join(info['path'], '.git', 'objects',
+                                       'info', 'alternates')
+        self.assertTrue(os.path.isfile(alternates_path))
+
+    def test_existing_checkout_moves_to_mirror(self):
+        checkout_path = os.path.join(self.workingdir, 'package')
+        GitClient().checkout(self.url, checkout_path)
+
+        client = self._makeOne()
+        client.checkout_or_update(self.url, self.workingdir)
+        result = run_cmd(('git', 'remote', 'get-url', 'origin'),
+                         cwd=checkout_path)
+        self.assertEqual(result.output.strip(),
+                         client.get_mirror_path(self.url))
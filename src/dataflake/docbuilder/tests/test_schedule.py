@@ -0,0 +1,61 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the build schedule
+"""
+
+import unittest
+
+from ..schedule import BuildSchedule
+
+
+class BuildScheduleTests(unittest.TestCase):
+
+    def _pop_all(self, schedule):
+        builds = []
+        while schedule:
+            builds.append(schedule.pop())
+        return builds
+
+    def test_empty(self):
+        schedule = BuildSchedule()
+
+        self.assertEqual(len(schedule), 0)
+        self.assertFalse(schedule)
+
+    def test_main_branches_first(self):
+        schedule = BuildSchedule()
+        schedule.add('pkg1', 'master', 0)
+        schedule.add('pkg1', '2.0', 1)
+        schedule.add('pkg1', '1.0', 2)
+        schedule.add('pkg2', 'main', 0)
+        schedule.add('pkg2', '0.9', 1)
+
+        self.assertEqual(len(schedule), 5)
+        self.assertEqual(self._pop_all(schedule),
+                         [('pkg1', 'master'), ('pkg2', 'main'),
+                          ('pkg1', '2.0'), ('pkg2', '0.9'),
+                          ('pkg1', '1.0')])
+
+    def test_weights(self):
+        schedule = BuildSchedule({'heavy': 2, 'light': 0.5})
+        for package_name in ('light', 'normal', 'heavy'):
+            for rank, tag in enumerate(('main', '3', '2', '1')):
+                schedule.add(package_name, tag, rank)
+
+        builds = self._pop_all(schedule)
+        self.assertEqual(builds[:3], [('heavy', 'main'), ('normal', 'main'),
+                                      ('light', 'main')])
+        # Rank 2 of "heavy" comes with rank 1 of "normal", before it
+        self.assertEqual(builds[3:6], [('heavy', '3'), ('heavy', '2'),
+                                       ('normal', '3')])
+        self.assertEqual(builds[-1], ('light', '1'))
@@ -0,0 +1,63 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the tag selection
+"""
+
+import unittest
+
+from ..tags import TagSelector
+
+
+TAGS = ['1.10', '1.9', 'v2.0', '2.0a1', '2.1.dev1', 'pre-merge-foo',
+        '1.9.1', '0.1']
+
+
+class TagSelectorTests(unittest.TestCase):
+
+    def test_defaults(self):
+        selector = TagSelector()
+
+        self.assertEqual(selector.select(TAGS),
+                         ['0.1', '1.9', '1.9.1', '1.10', 'v2.0'])
+
+    def test_no_tags(self):
+        self.assertEqual(TagSelector().select([]), [])
+
+    def test_prereleases(self):
+        selector = TagSelector(prereleases=True)
+
+        self.assertEqual(selector.select(TAGS),
+                         ['0.1', '1.9', '1.9.1', '1.10', '2.0a1', 'v2.0',
+                          '2.1.dev1'])
+
+    def test_include(self):
+        selector = TagSelector(include=r'^1\.')
+
+        self.assertEqual(selector.select(TAGS), ['1.9', '1.9.1', '1.10'])
+
+    def test_exclude(self):
+        selector = TagSelector(exclude=r'^v|^0\.')
+
+        self.assertEqual(selector.select(TAGS), ['1.9', '1.9.1', '1.10'])
+
+    def test_latest_patch(self):
+        selector = TagSelector(latest_patch=True)
+
+        self.assertEqual(selector.select(TAGS + ['3']),
+                         ['0.1', '1.9.1', '1.10', 'v2.0', '3'])
+
+    def test_parse(self):
+        selector = TagSelector()
+
+        self.assertEqual(str(selector.parse('v1.2')), '1.2')
+        self.assertIsNone(selector.parse('pre-merge-foo'))
@@ -0,0 +1,119 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the shared utility functions
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from .. import utils
+from ..utils import run_cmd
+from ..utils import write_if_changed
+
+
+class RunCmdTests(unittest.TestCase):
+
+    def test_success(self):
+        result = run_cmd((sys.executable, '-c', 'print("hello")'))
+
+        self.assertTrue(result)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.output.strip(), 'hello')
+        self.assertFalse(result.timed_out)
+
+    def test_failure(self):
+        result = run_cmd((sys.executable, '-c',
+                          'import sys; sys.exit("broken")'))
+
+        self.assertFalse(result)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('exit code 1: broken', result.describe())
+
+    def test_timeout(self):
+        result = run_cmd((sys.executable, '-c',
+                          'import time; time.sleep(10)'), timeout=0.2)
+
+        self.assertFalse(result)
+        self.assertTrue(result.timed_out)
+        self.assertIsNone(result.returncode)
+        self.assertLess(result.duration, 5)
+        self.assertIn('timed out after', result.describe())
+
+    def test_missing_program(self):
+        result = run_cmd(('docbuilder-no-such-program',))
+
+        self.assertFalse(result)
+        self.assertIsNone(result.returncode)
+        self.assertTrue(result.error)
+
+    def test_cwd(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        result = run_cmd((sys.executable, '-c',
+                          'import os; print(os.getcwd())'), cwd=folder)
+
+        self.assertEqual(os.path.realpath(result.output.strip()),
+                         os.path.realpath(folder))
+
+    def test_output_bytes(self):
+        # Counted from the raw output, not from the decoded text
+        result = run_cmd((sys.executable, '-c',
+                          'import sys; sys.stdout.buffer.write(b"\\xff\\xfe");'
+                          'sys.stderr.buffer.write(b"abc")'))
+
+        self.assertEqual(result.output_bytes, 5)
+
+    def test_command_listeners(self):
+        results = []
+        utils.command_listeners.append(results.append)
+        try:
+            result = run_cmd((sys.executable, '-c', 'pass'))
+        finally:
+            utils.command_listeners.remove(results.append)
+
+        self.assertEqual(results, [result])
+
+
+class WriteIfChangedTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'index.rst')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_new_file(self):
+        self.assertTrue(write_if_changed(self.path, 'text'))
+        with open(self.path) as fp:
+            self.assertEqual(fp.read(), 'text')
+
+    def test_unchanged_file(self):
+        write_if_changed(self.path, 'text')
+        os.utime(self.path, (0, 0))
+
+        self.assertFalse(write_if_changed(self.path, 'text'))
+        self.assertEqual(os.path.getmtime(self.path), 0)
+
+    def test_changed_file(self):
+        write_if_changed(self.path, 'text')
+        os.utime(self.path, (0, 0))
+
+        self.assertTrue(write_if_changed(self.path, 'other text'))
+        with open(self.path) as fp:
+            self.assertEqual(fp.read(), 'other text')
+        self.assertNotEqual(os.path.getmtime(self.path), 0)
+        self.assertEqual(os.listdir(self.folder), ['index.rst'])
@@ -15,24 +15,103 @@
 
 import os
 import subprocess
+import time
 
 
-def shell_cmd(cmd, fromwhere=None, quiet=False):
-    cwd = os.getcwd()
-    if fromwhere:
-        os.chdir(fromwhere)
+# Callables that are called with every ``CommandResult``
+command_listeners = []
 
+
+class CommandResult:
+    """ The outcome of a command run with ``run_cmd``
+    """
+
+    def __init__(self, args, cwd, returncode, output, error, duration,
+                 timed_out=False, output_bytes=0):
+        self.args = args
+        self.cwd = cwd
+        self.returncode = returncode
+        self.output = output
+        self.error = error
+        self.duration = duration
+        self.timed_out = timed_out
+        # Number of bytes the command wrote to stdout and stderr
+        self.output_bytes = output_bytes
+
+    def __bool__(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return (f'<CommandResult {" ".join(self.args)!r} '
+                f'returncode={self.returncode} '
+                f'duration={self.duration:.3f}s>')
+
+    def describe(self):
+        """ A one-line explanation of a failure, useful for logging
+        """
+        cmd = ' '.join(self.args)
+        if self.timed_out:
+            return f'{cmd}: timed out after {self.duration:.1f} seconds'
+        detail = self.error.strip() or self.output.strip()
+        return f'{cmd}: exit code {self.returncode}: {detail}'
+
+
+def run_cmd(args, cwd=None, timeout=None, env=None):
+    """ Run a command given as argument list and return a ``CommandResult``
+
+    The command runs in ``cwd`` without changing the working directory of
+    the current process, so it is safe to use from several threads. No
+    exception is raised for failures or timeouts, check the result.
+    """
+    args = [str(x) for x in args]
+    start = time.monotonic()
+    timed_out = False
     try:
-        output = subprocess.check_output(cmd, shell=True)
-    except subprocess.CalledProcessError as e:
-        output = e.output
-        print(f'{cmd}: {output}')
+        process = subprocess.run(args,
+                                 cwd=cwd or None,
+                                 env=env,
+                                 stdin=subprocess.DEVNULL,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 timeout=timeout)
+        returncode = process.returncode
+        output, error = process.stdout, process.stderr
+    except subprocess.TimeoutExpired as e:
+        returncode = None
+        output, error = e.stdout or b'', e.stderr or b''
+        timed_out = True
+    except OSError as e:
+        returncode = None
+        output, error = b'', str(e).encode('UTF-8')
+
+    result = CommandResult(args,
+                           cwd,
+                           returncode,
+                           output.decode('UTF-8', 'replace'),
+                           error.decode('UTF-8', 'replace'),
+                           time.monotonic() - start,
+                           timed_out=timed_out,
+                           output_bytes=len(output) + len(error))
+    for listener in command_listeners:
+        listener(result)
+
+    return result
+
 
-    # Output is used to initialize an io.StringIO instance, which wants unicode
-    if isinstance(output, bytes):
-        output = output.decode('UTF-8')
+def write_if_changed(path, text):
+    """ Write ``text`` to the file at ``path`` unless it is already there
 
-    os.chdir(cwd)
+    Unchanged files keep their modification time, so tools like Sphinx
+    that look at it will not consider them outdated. Returns True if the
+    file was written.
+    """
+    if os.path.isfile(path):
+        with open(path) as fp:
+            if fp.read() == text:
+                return False
 
-    if output and not quiet:
-        return output
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as fp:
+        fp.write(text)
+    os.replace(tmp_path, path)
+    return True
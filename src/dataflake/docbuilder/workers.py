@@ -0,0 +1,284 @@
+##############################################################################
+#
+# Copyright (c) 2010-2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Worker processes for Sphinx builds
+"""
+
+import collections
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+
+LOG = logging.getLogger()
+
+# Imported once by the fork server, every worker starts with them loaded
+PRELOAD = ('dataflake.docbuilder.builder',
+           'sphinx.application',
+           'sphinx.builders.html',
+           'sphinx.environment',
+           'sphinx.ext.autodoc',
+           'sphinx.ext.intersphinx',
+           'sphinx.ext.napoleon',
+           'sphinx.ext.todo',
+           'sphinx.ext.viewcode')
+
+
+class WorkerError(Exception):
+    """ A worker process died while running a task
+    """
+
+
+class WorkerPool:
+    """ Runs tasks in worker processes forked from a preloaded template
+
+    On platforms that support it, workers are forked from a fork server
+    that has imported the ``preload`` modules, so a new worker starts in
+    milliseconds with `Sphinx` and its extensions ready. Each worker runs
+    one task at a time and has no state in common with the builder
+    process. By default a worker exits after its first task, so modules
+    and registries set up by one task never leak into the next. With a
+    higher ``max_tasks``, or 0 for no limit, workers are reused. A worker
+    that uses more than ``memory_limit`` bytes after a task is always
+    replaced by a fresh one. ``submit`` returns a
+    ``concurrent.futures.Future`` like an executor does.
+    """
+
+    def __init__(self, max_workers, memory_limit=None, max_tasks=1,
+                 preload=PRELOAD):
+        self.max_workers = max_workers
+        self.memory_limit = memory_limit
+        self.max_tasks = max_tasks
+        self.recycled = 0
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context('forkserver')
+            self._context.set_forkserver_preload(list(preload))
+        else:
+            self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._workers = []
+        self._shutdown = False
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(
+                                                                duplex=False)
+        self._thread = threading.Thread(target=self._manage,
+                                        name='docbuilder-workers',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('Cannot submit to a pool after shutdown')
+            self._pending.append((future, fn, args))
+        self._wakeup()
+        return future
+
+    def shutdown(self, wait=True):
+        """ Stop all workers after the submitted tasks are finished
+        """
+        with self._lock:
+            self._shutdown = True
+        self._wakeup()
+        if wait:
+            self._thread.join()
+
+    def _wakeup(self):
+        self._wakeup_writer.send(None)
+
+    def _manage(self):
+        """ Hand out tasks and collect results, runs in a thread
+        """
+        while True:
+            with self._lock:
+                self._dispatch()
+                if self._shutdown and not self._pending and \
+                   all(x.task is None for x in self._workers):
+                    break
+                waitables = {self._wakeup_reader: None}
+                for worker in self._workers:
+                    waitables[worker.connection] = worker
+                    waitables[worker.process.sentinel] = worker
+
+            for ready in wait(list(waitables)):
+                worker = waitables[ready]
+                if worker is None:
+                    while self._wakeup_reader.poll():
+                        self._wakeup_reader.recv()
+                    continue
+                if worker not in self._workers:
+                    continue  # Replaced while handling an earlier event
+                if ready is worker.connection or worker.connection.poll():
+                    self._receive(worker)
+                if ready is worker.process.sentinel and \
+                   worker in self._workers:
+                    self._lost(worker)
+
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def _dispatch(self):
+        """ Give pending tasks to idle workers, starting workers if needed
+        """
+        while self._pending:
+            idle = [x for x in self._workers if x.task is None]
+            if idle:
+                worker = idle[0]
+            elif len(self._workers) < self.max_workers:
+                worker = _Worker(self._context, self.memory_limit,
+                                 self.max_tasks)
+                self._workers.append(worker)
+            else:
+                break
+            future, fn, args = self._pending.popleft()
+            if future.set_running_or_notify_cancel():
+                worker.run(future, fn, args)
+
+    def _receive(self, worker):
+        try:
+            ok, value, memory = worker.connection.recv()
+        except (EOFError, OSError):
+            return self._lost(worker)
+
+        future, worker.task = worker.task, None
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+        if self.memory_limit and memory > self.memory_limit:
+            LOG.info(f'Worker {worker.process.pid} uses '
+                     f'{memory // 1048576} MB, replacing it.')
+        elif self.max_tasks and worker.tasks >= self.max_tasks:
+            LOG.debug(f'Worker {worker.process.pid} has run {worker.tasks} '
+                      'tasks, replacing it.')
+        else:
+            return
+        with self._lock:
+            self._workers.remove(worker)
+        worker.stop()
+        self.recycled += 1
+
+    def _lost(self, worker):
+        """ Clean up after a worker process that exited unexpectedly
+        """
+        worker.process.join()
+        with self._lock:
+            self._workers.remove(worker)
+        if worker.task is not None:
+            msg = f'Worker process exited with code {worker.process.exitcode}'
+            worker.task.set_exception(WorkerError(msg))
+        worker.connection.close()
+
+
+class _Worker:
+
+    def __init__(self, context, memory_limit, max_tasks):
+        self.task = None
+        self.tasks = 0
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_work,
+                                       args=(child_connection, memory_limit,
+                                             max_tasks),
+                                       daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def run(self, future, fn, args):
+        self.task = future
+        self.tasks += 1
+        self.connection.send((fn, args))
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.connection.close()
+
+
+def _work(connection, memory_limit, max_tasks):
+    """ Main loop of a worker process
+    """
+    tasks = 0
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        fn, args = task
+        tasks += 1
+        try:
+            result = (True, fn(*args))
+        except Exception as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(f'{e.__class__.__name__}: {e}')
+            result = (False, e)
+        memory = memory_usage()
+        connection.send(result + (memory,))
+        if memory_limit and memory > memory_limit:
+            break
+        if max_tasks and tasks >= max_tasks:
+            break
+
+
+def memory_usage(field='VmRSS'):
+    """ Get the resident memory of this process in bytes
+
+    With ``field`` set to ``VmHWM`` the peak resident memory is returned.
+    """
+    try:
+        with open(f'/proc/{os.getpid()}/status') as fp:
+            for line in fp:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def peak_memory_usage():
+    """ Get the peak resident memory of this process in bytes
+
+    This is the peak since the last ``reset_peak_memory`` call, or since
+    the process started if the peak cannot be reset on this platform.
+    """
+    return memory_usage('VmHWM')
+
+
+def reset_peak_memory():
+    """ Start measuring the peak resident memory from the current usage
+    """
+    try:
+        with open(f'/proc/{os.getpid()}/clear_refs', 'w') as fp:
+            fp.write('5')
+    except OSError:
+        pass